@@ -0,0 +1,265 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Count, Max, Q, Sum
+from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_GET
+
+from etherscan_app.models import (Address, AddressStats, AddressTransaction,
+                                  AddressUserRelationship)
+from etherscan_app.pagecache import get_page_version
+from etherscan_app.pagination import paginate_transactions
+from etherscan_app.utils import is_number
+from etherscan_app.views import get_user_address
+
+
+def get_stats(relationship):
+    try:
+        return relationship.address.stats
+    except AddressStats.DoesNotExist:
+        # Addresses whose first sync hasn't saved anything yet
+        return AddressStats()
+
+
+def format_wei(value):
+    """
+    Amounts of wei are sent as strings, JSON numbers can't hold uint256 values
+    """
+    return None if value is None else str(value)
+
+
+ADDRESS_FIELDS = {
+    "address": lambda x: x.address_id,
+    "alias": lambda x: x.alias,
+    "synced_block": lambda x: x.address.synced_block,
+    "updated_at": lambda x: x.address.updated_at,
+    "transaction_count": lambda x: get_stats(x).transaction_count,
+    "total_in_wei": lambda x: format_wei(get_stats(x).total_in_wei),
+    "total_out_wei": lambda x: format_wei(get_stats(x).total_out_wei),
+    "last_activity": lambda x: get_stats(x).last_activity,
+}
+FOLDER_FIELDS = {
+    "id": lambda x: x.pk,
+    "folder_name": lambda x: x.folder_name,
+    "address_count": lambda x: x.address_count,
+    "transaction_count": lambda x: x.transaction_count or 0,
+    "total_in_wei": lambda x: format_wei(x.total_in_wei or 0),
+    "total_out_wei": lambda x: format_wei(x.total_out_wei or 0),
+    "last_activity": lambda x: x.last_activity,
+}
+TRANSACTION_FIELDS = {
+    "hash": lambda x: x.transaction_id,
+    "block_number": lambda x: x.block_number,
+    "timestamp": lambda x: x.transaction.timestamp,
+    "from_account": lambda x: x.transaction.from_account,
+    "to_account": lambda x: x.transaction.to_account,
+    "direction": lambda x: x.direction,
+    "counterparty": lambda x: x.counterparty,
+    "value_in_wei": lambda x: format_wei(x.transaction.value_in_wei),
+    "value_in_ether": lambda x: format(x.transaction.value_in_ether, "f"),
+    "gas": lambda x: x.transaction.gas,
+    "gas_price": lambda x: format_wei(x.transaction.gas_price),
+    "gas_used": lambda x: x.transaction.gas_used,
+    "is_error": lambda x: x.transaction.is_error,
+}
+
+
+def api_login_required(view):
+    """
+    Answers anonymous requests with a 401 instead of redirecting them to the login page
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Authentication required"}, status=401)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def get_etag(request, *args, **kwargs):
+    """
+    Takes in a request
+    Returns a tag that changes with the path and with any data shown to the user
+    """
+    version = get_page_version(request.user.pk)
+    return hashlib.md5(f"{version}:{request.get_full_path()}".encode()).hexdigest()
+
+
+def get_address_last_modified(request, address):
+    try:
+        return get_user_address(request.user, address).updated_at
+    except Address.DoesNotExist:
+        return None
+
+
+def get_fields(request, fields):
+    """
+    Takes in a request and the fields of a resource
+    Returns the fields picked by the fields parameter, all of them by default
+    """
+    picked = [x for x in request.GET.get("fields", "").split(",") if x]
+    unknown = [x for x in picked if x not in fields]
+    if unknown:
+        raise ValueError(f"Unknown fields {', '.join(unknown)}")
+    return {x: fields[x] for x in picked or fields}
+
+
+def get_page_size(request):
+    limit = request.GET.get("limit", "")
+    if not limit:
+        return settings.API_PAGE_SIZE
+    if not is_number(limit) or not 0 < int(limit) <= settings.API_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {settings.API_PAGE_SIZE}")
+    return int(limit)
+
+
+def get_next_url(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params["after"] = cursor
+    return f"{request.path}?{params.urlencode()}"
+
+
+def paginate_by_pk(queryset, request, page_size, field="pk"):
+    """
+    Takes in a queryset, the request and a page size
+    Returns the page after the after parameter and the cursor of the next page
+    """
+    queryset = queryset.order_by(field)
+    after = request.GET.get("after")
+    if after:
+        queryset = queryset.filter(**{f"{field}__gt": after})
+    page = list(queryset[: page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        next_cursor = str(getattr(page[page_size - 1], field))
+    return page[:page_size], next_cursor
+
+
+def page_response(request, page, next_cursor, fields):
+    results = [{x: get_value(item) for x, get_value in fields.items()} for item in page]
+    return JsonResponse(
+        {"results": results, "next": get_next_url(request, next_cursor)}
+    )
+
+
+def filter_transactions(links, params):
+    """
+    Takes in address transactions and the query parameters
+    Returns them filtered by time, counterparty and value
+    """
+    for param, lookup in [("since", "gte"), ("until", "lt")]:
+        if params.get(param):
+            timestamp = parse_datetime(params[param])
+            if timestamp is None:
+                raise ValueError(f"{param} must be an ISO 8601 date and time")
+            links = links.filter(**{f"transaction__timestamp__{lookup}": timestamp})
+    for param, lookup in [("min_value", "gte"), ("max_value", "lte")]:
+        if params.get(param):
+            if not is_number(params[param]):
+                raise ValueError(f"{param} must be an amount of wei")
+            links = links.filter(
+                **{f"transaction__value_in_wei__{lookup}": params[param]}
+            )
+    counterparty = params.get("counterparty")
+    if counterparty:
+        links = links.filter(
+            Q(
+                direction=AddressTransaction.IN,
+                transaction__from_account__iexact=counterparty,
+            )
+            | Q(
+                direction__in=[AddressTransaction.OUT, AddressTransaction.SELF],
+                transaction__to_account__iexact=counterparty,
+            )
+        )
+    return links
+
+
+@require_GET
+@api_login_required
+@gzip_page
+@condition(etag_func=get_etag)
+def addresses(request):
+    """
+    Saved addresses of the user with their totals, optionally those of a folder
+    """
+    relationships = AddressUserRelationship.objects.filter(
+        user=request.user
+    ).select_related("address", "address__stats")
+    folder_id = request.GET.get("folder")
+    if folder_id:
+        if not is_number(folder_id):
+            return JsonResponse({"error": "folder must be a folder id"}, status=400)
+        relationships = relationships.filter(
+            address__folders__pk=folder_id, address__folders__user=request.user
+        )
+    try:
+        fields = get_fields(request, ADDRESS_FIELDS)
+        page_size = get_page_size(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    page, next_cursor = paginate_by_pk(relationships, request, page_size, "address_id")
+    return page_response(request, page, next_cursor, fields)
+
+
+@require_GET
+@api_login_required
+@gzip_page
+@condition(etag_func=get_etag)
+def folders(request):
+    """
+    Folders of the user with the totals of their addresses
+    """
+    if not is_number(request.GET.get("after", "0")):
+        return JsonResponse({"error": "after must be a folder id"}, status=400)
+    try:
+        fields = get_fields(request, FOLDER_FIELDS)
+        page_size = get_page_size(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    folder_list = request.user.folders.annotate(
+        address_count=Count("addresses"),
+        transaction_count=Sum("addresses__stats__transaction_count"),
+        total_in_wei=Sum("addresses__stats__total_in_wei"),
+        total_out_wei=Sum("addresses__stats__total_out_wei"),
+        last_activity=Max("addresses__stats__last_activity"),
+    )
+    page, next_cursor = paginate_by_pk(folder_list, request, page_size)
+    return page_response(request, page, next_cursor, fields)
+
+
+@require_GET
+@api_login_required
+@gzip_page
+@condition(etag_func=get_etag, last_modified_func=get_address_last_modified)
+def transactions(request, address):
+    """
+    Transactions of a saved address or alias, newest block first
+    Last-Modified follows the last ingest of the address
+    """
+    try:
+        address_instance = get_user_address(request.user, address)
+    except Address.DoesNotExist:
+        return JsonResponse({"error": f"Unknown address {address}"}, status=404)
+    try:
+        fields = get_fields(request, TRANSACTION_FIELDS)
+        page_size = get_page_size(request)
+        links = filter_transactions(
+            address_instance.transaction_links.all(), request.GET
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    page, next_cursor = paginate_transactions(
+        links, request.GET.get("after"), page_size
+    )
+    return page_response(request, page, next_cursor, fields)
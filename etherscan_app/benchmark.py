@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qsl, urlparse
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from etherscan_app import client
+from etherscan_app.models import (Address, AddressTransaction,
+                                  AddressUserRelationship, Folder, Transaction)
+from etherscan_app.pagecache import bump_page_versions
+from etherscan_app.pagination import encode_cursor
+from etherscan_app.utils import (get_direction, get_transaction_fields,
+                                 rebuild_address_stats,
+                                 sync_address_transactions)
+
+TRANSACTIONS_PER_BLOCK = 3
+
+
+def get_synthetic_transaction(address, position):
+    """
+    Takes in an address and the position of one of its transactions
+    Returns the same txlist row for the same position on every run
+    """
+    block_number = 1 + position // TRANSACTIONS_PER_BLOCK
+    counterparty = "0x" + hashlib.sha1(str(position % 100).encode()).hexdigest()
+    if position % 2:
+        from_account, to_account = address, counterparty
+    else:
+        from_account, to_account = counterparty, address
+    return {
+        "blockNumber": str(block_number),
+        "timeStamp": str(1600000000 + block_number * 13),
+        "hash": "0x" + hashlib.sha256(f"{address}:{position}".encode()).hexdigest(),
+        "from": from_account,
+        "to": to_account,
+        "value": str(10**12 * (position % 1000 + 1)),
+        "gas": "21000",
+        "gasPrice": "100000000000",
+        "gasUsed": "21000",
+        "isError": "0",
+    }
+
+
+def get_benchmark_address():
+    """
+    Returns a new address, so cached Etherscan responses of earlier runs aren't reused
+    """
+    return f"0x{uuid.uuid4().hex}{0:08x}"
+
+
+class FakeEtherscanServer:
+    """
+    Local stand-in for the Etherscan txlist API, served from a background thread
+    Every address has transaction_count synthetic transactions
+    """
+
+    def __init__(self, transaction_count):
+        self.transaction_count = transaction_count
+        self.request_count = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.request_count += 1
+                params = dict(parse_qsl(urlparse(self.path).query))
+                body = json.dumps(server.txlist(params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/api"
+
+    def txlist(self, params):
+        start_block = int(params.get("startblock", 0))
+        end_block = int(params.get("endblock", 99999999))
+        page_size = int(params.get("offset", 10000))
+        page = int(params.get("page", 1))
+        first = max(0, start_block - 1) * TRANSACTIONS_PER_BLOCK
+        first += (page - 1) * page_size
+        last = min(
+            first + page_size,
+            end_block * TRANSACTIONS_PER_BLOCK,
+            self.transaction_count,
+        )
+        result = [
+            get_synthetic_transaction(params["address"], x) for x in range(first, last)
+        ]
+        if not result:
+            return {"status": "0", "message": "No transactions found", "result": []}
+        return {"status": "1", "message": "OK", "result": result}
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@contextmanager
+def fake_etherscan(transaction_count):
+    """
+    Takes in the number of transactions of every address
+    Points the Etherscan client to a fake server without a rate limit
+    """
+    with FakeEtherscanServer(transaction_count) as server, override_settings(
+        ETHERSCAN_API_URL=server.url,
+        ETHERSCAN_RATE_LIMIT={"max_calls": 10**6, "period": 1},
+    ), mock.patch.dict(os.environ, {"ETHERSCAN_API_TOKEN": "benchmark"}):
+        # The client of the process keeps the URL it was created with
+        client._client = None
+        try:
+            yield server
+        finally:
+            client._client = None
+
+
+def summarize_timings(timings):
+    """
+    Takes in durations in seconds
+    Returns their percentiles in milliseconds
+    """
+    if len(timings) == 1:
+        # quantiles needs two durations, every percentile of one is that duration
+        percentiles = timings * 99
+    else:
+        percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+    }
+
+
+def benchmark_ingest(transaction_count):
+    """
+    Takes in the number of transactions to ingest
+    Syncs a new address from the fake server
+    Returns the rows inserted per second, the Etherscan requests and the queries
+    """
+    address = Address(address=get_benchmark_address())
+    # Saved without signals so the sync runs here instead of in django-q
+    Address.objects.bulk_create([address])
+    with fake_etherscan(transaction_count) as server, CaptureQueriesContext(
+        connection
+    ) as queries, mock.patch("etherscan_app.utils.async_task"):
+        # Indexing the benchmark data would write to the shared search cluster
+        started_at = time.perf_counter()
+        created_count = sync_address_transactions(address.pk, start_block=0)
+        elapsed = time.perf_counter() - started_at
+    return {
+        "transactions": created_count,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(created_count / elapsed, 1),
+        "etherscan_requests": server.request_count,
+        "queries": len(queries),
+    }
+
+
+def seed_transactions(address, transaction_count):
+    """
+    Takes in a saved address and a number of transactions
+    Inserts its synthetic transactions straight into the database
+    """
+    transactions = []
+    links = []
+    for position in range(transaction_count):
+        row = get_synthetic_transaction(address.pk, position)
+        transaction = Transaction(hash=row["hash"], **get_transaction_fields(row))
+        transactions.append(transaction)
+        links.append(
+            AddressTransaction(
+                address=address,
+                transaction=transaction,
+                direction=get_direction(row, address.pk),
+                block_number=transaction.block_number,
+            )
+        )
+        if len(transactions) == settings.TRANSACTION_BATCH_SIZE:
+            Transaction.objects.bulk_create(transactions)
+            AddressTransaction.objects.bulk_create(links)
+            transactions = []
+            links = []
+    Transaction.objects.bulk_create(transactions)
+    AddressTransaction.objects.bulk_create(links)
+    rebuild_address_stats([address.pk])
+
+
+def benchmark_views(transaction_count, repeat):
+    """
+    Takes in the number of transactions of the address and the requests per view
+    Returns the latency percentiles and the queries of each view, rendered (cold)
+    and served from the page cache (warm)
+    """
+    address = Address(address=get_benchmark_address())
+    Address.objects.bulk_create([address])
+    seed_transactions(address, transaction_count)
+    user = User.objects.create(username=f"benchmark-{address.pk}")
+    AddressUserRelationship.objects.bulk_create(
+        [AddressUserRelationship(user=user, address=address)]
+    )
+    folder = Folder(user=user, folder_name="benchmark")
+    Folder.objects.bulk_create([folder])
+    folder = Folder.objects.get(user=user)
+    address.folders.add(folder)
+
+    middle = AddressTransaction.objects.filter(address=address).order_by(
+        "-block_number", "-transaction"
+    )[transaction_count // 2]
+    transactions_url = reverse("etherscan_app:show-transactions", args=[address.pk])
+    urls = {
+        "show_transactions": transactions_url,
+        "show_transactions_middle_page": (
+            f"{transactions_url}?after={encode_cursor(middle)}"
+        ),
+        "show_folder": reverse("etherscan_app:show-folder", args=[folder.pk]),
+        "show_folders": reverse("etherscan_app:show-folders"),
+    }
+
+    client = Client()
+    client.force_login(user)
+    report = {}
+    for name, url in urls.items():
+        report[name] = {
+            "cold": time_requests(client, url, repeat, user),
+            "warm": time_requests(client, url, repeat),
+        }
+    return report
+
+
+def time_requests(client, url, repeat, user=None):
+    """
+    Takes in a logged in client, a URL, the number of requests and optionally the user
+    whose cached pages are made stale before each request
+    Returns the latency percentiles and the most queries a request ran
+    """
+    # Fills the cache, so the warm requests are all served from it
+    client.get(url)
+    timings = []
+    query_counts = []
+    for _ in range(repeat):
+        if user is not None:
+            bump_page_versions([user.pk])
+        with CaptureQueriesContext(connection) as queries:
+            started_at = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - started_at)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+        query_counts.append(len(queries))
+    return {**summarize_timings(timings), "queries": max(query_counts)}
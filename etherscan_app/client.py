@@ -0,0 +1,192 @@
+import logging
+import math
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+import requests
+from redis.exceptions import LockError
+from requests.adapters import HTTPAdapter
+
+from etherscan_app.metrics import (ETHERSCAN_REQUEST_SECONDS,
+                                   ETHERSCAN_RESPONSES)
+from etherscan_app.ratelimit import acquire_api_token
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RATE_LIMIT_RESULT = "Max rate limit reached"
+
+
+class EtherscanError(Exception):
+    pass
+
+
+def get_api_tokens():
+    """
+    Returns the Etherscan API tokens, given comma separated in ETHERSCAN_API_TOKEN
+    """
+    api_tokens = os.environ.get("ETHERSCAN_API_TOKEN", "").split(",")
+    return [x.strip() for x in api_tokens if x.strip()]
+
+
+class EtherscanClient:
+    """
+    Etherscan API client keeping its connections alive between calls
+    Throttled and failed calls are retried with a jittered exponential backoff
+    """
+
+    def __init__(self, api_url=None, timeout=None, retries=None, backoff=None):
+        self.api_url = api_url or settings.ETHERSCAN_API_URL
+        self.timeout = timeout or settings.ETHERSCAN_TIMEOUT
+        self.retries = settings.ETHERSCAN_RETRIES if retries is None else retries
+        self.backoff = settings.ETHERSCAN_BACKOFF if backoff is None else backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=settings.ETHERSCAN_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_fetch_timeout(self):
+        """
+        Returns the seconds the slowest call can take: every attempt waiting for a rate
+        limit token and timing out, plus the longest backoff before every retry
+        """
+        timeout = self.timeout
+        if isinstance(timeout, tuple):
+            # Connect and read timeouts
+            timeout = sum(timeout)
+        rate_limit_wait = settings.ETHERSCAN_RATE_LIMIT["period"]
+        backoff = sum(self.backoff * 2**x * 1.5 for x in range(self.retries))
+        return math.ceil((self.retries + 1) * (timeout + rate_limit_wait) + backoff)
+
+    def get(self, params):
+        """
+        Takes in the query parameters of an API call
+        Returns the response json, or None without an API token
+        """
+        api_tokens = get_api_tokens()
+        if not api_tokens:
+            return None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logger.warning(f"Retrying Etherscan in {delay:.2f}s: {error}")
+                time.sleep(delay)
+
+            params = {**params, "apikey": acquire_api_token(api_tokens)}
+            started_at = time.perf_counter()
+            try:
+                response = self.session.get(
+                    self.api_url, params=params, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                ETHERSCAN_RESPONSES.inc(status="error")
+                error = e
+                continue
+            finally:
+                ETHERSCAN_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started_at, action=params.get("action")
+                )
+            ETHERSCAN_RESPONSES.inc(status=response.status_code)
+
+            if response.status_code in RETRY_STATUS_CODES:
+                error = f"HTTP {response.status_code}"
+                continue
+            # Callers only handle EtherscanError, e.g. a sync counts the address failed
+            try:
+                response.raise_for_status()
+                response_data = response.json()
+            except requests.HTTPError as e:
+                raise EtherscanError(f"Etherscan failed: {e}") from e
+            except ValueError as e:
+                # e.g. the HTML error page of a proxy
+                raise EtherscanError(
+                    f"Etherscan sent a response that isn't JSON: {e}"
+                ) from e
+            if not isinstance(response_data, dict) or "result" not in response_data:
+                raise EtherscanError("Etherscan sent a response without a result")
+            if str(response_data["result"]).startswith(RATE_LIMIT_RESULT):
+                error = response_data["result"]
+                continue
+            return response_data
+
+        raise EtherscanError(f"Etherscan failed after {attempt + 1} attempts: {error}")
+
+    def txlist(
+        self, address, start_block=0, end_block=99999999, page_size=None, page=1
+    ):
+        """
+        Takes in an address, the block range and optionally a page size and number
+        Returns the response json of its normal transactions in ascending order
+        """
+        params = {
+            "module": "account",
+            "action": "txlist",
+            "address": address,
+            "startblock": start_block,
+            "endblock": end_block,
+            "sort": "asc",
+        }
+        if page_size:
+            params.update(page=page, offset=page_size)
+        return self.get(params)
+
+    def cached_txlist(
+        self, address, start_block=0, end_block=99999999, page_size=None, page=1
+    ):
+        """
+        Takes in an address, the block range and optionally a page size and number
+        Returns the txlist response json, shared through the etherscan cache
+        Concurrent callers wait for the one fetching the same response
+        """
+        cache = caches["etherscan"]
+        key = f"txlist:{address.lower()}:{start_block}:{end_block}:{page_size}:{page}"
+        response_data = cache.get(key)
+        if response_data is not None:
+            return response_data
+
+        # Held, and waited for, as long as the fetch can take so it can't expire first
+        lock_timeout = self.get_fetch_timeout()
+        lock = cache.lock(f"etherscan:{key}:lock", timeout=lock_timeout)
+        locked = lock.acquire(blocking_timeout=lock_timeout)
+        try:
+            # The lock holder may have cached it while we waited
+            response_data = cache.get(key)
+            if response_data is None:
+                response_data = self.txlist(
+                    address,
+                    start_block=start_block,
+                    end_block=end_block,
+                    page_size=page_size,
+                    page=page,
+                )
+                # Errors aren't cached, "No transactions found" is
+                if response_data and isinstance(response_data["result"], list):
+                    cache.set(key, response_data)
+        finally:
+            if locked:
+                try:
+                    lock.release()
+                except LockError as e:
+                    # The response is still good if the lock expired while fetching it
+                    logger.warning(f"Failed to release the lock of {key}: {e}")
+        return response_data
+
+
+_client = None
+
+
+def get_client():
+    """
+    Returns the client of the current process
+    Created lazily so django-q workers don't share a connection pool across forks
+    """
+    global _client
+    if _client is None:
+        _client = EtherscanClient()
+    return _client
@@ -0,0 +1,66 @@
+import csv
+import json
+
+from django.conf import settings
+
+from etherscan_app.models import wei_to_ether
+
+# Export columns and the address transaction lookups they're read from
+EXPORT_FIELDS = {
+    "hash": "transaction",
+    "address": "address",
+    "block_number": "block_number",
+    "timestamp": "transaction__timestamp",
+    "from_account": "transaction__from_account",
+    "to_account": "transaction__to_account",
+    "direction": "direction",
+    "value_in_wei": "transaction__value_in_wei",
+    "gas": "transaction__gas",
+    "gas_price": "transaction__gas_price",
+    "gas_used": "transaction__gas_used",
+    "is_error": "transaction__is_error",
+}
+CSV_HEADER = list(EXPORT_FIELDS) + ["value_in_ether"]
+
+
+class Echo:
+    """
+    File-like object handing back what csv.writer writes instead of buffering it
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_export_rows(links):
+    """
+    Takes in an address transaction queryset
+    Yields its rows as dicts, read through a server-side cursor in chunks
+    """
+    rows = (
+        links.order_by("address", "block_number", "transaction")
+        .values_list(*EXPORT_FIELDS.values())
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    for row in rows:
+        row = dict(zip(EXPORT_FIELDS, row))
+        row["value_in_ether"] = format(wei_to_ether(row["value_in_wei"]), "f")
+        yield row
+
+
+def iter_csv(links):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in iter_export_rows(links):
+        yield writer.writerow([row[x] for x in CSV_HEADER])
+
+
+def iter_ndjson(links):
+    for row in iter_export_rows(links):
+        yield json.dumps(row, default=str) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+}
@@ -4,6 +4,18 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
 
 
+class AddressSearchForm(forms.Form):
+    address = forms.CharField(label="Address", max_length=42)
+
+    def __init__(self, *args, **kwargs):
+        super(AddressSearchForm, self).__init__(*args, **kwargs)
+        self.fields["address"].widget.attrs.update(style="max-width: 50%")
+        self.helper = FormHelper()
+        self.helper.add_input(Submit("search", "Search", css_class="btn-primary"))
+        # search.html renders the form tag posting to submit-address
+        self.helper.form_tag = False
+
+
 class FolderSelectionForm(forms.Form):
     folder = forms.ChoiceField(choices=())
 
@@ -1,34 +1,490 @@
 import logging
+import threading
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from functools import partial
 
-from elasticsearch_dsl import Document, Long, Text
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from django_q.models import Schedule
+from django_q.tasks import schedule
+from django_redis import get_redis_connection
+from elasticsearch.helpers import bulk, parallel_bulk
+from elasticsearch_dsl import (Boolean, Date, Document, Double, Keyword, Long,
+                               Text, analyzer, connections, token_filter)
+
+from etherscan_app.metrics import (SEARCH_INDEX_DOCUMENTS,
+                                   SEARCH_INDEX_SECONDS, TASKS_QUEUED,
+                                   flushes_metrics)
 
 logger = logging.getLogger(__name__)
 
+DIRTY_KEY = "search:dirty:{}"
+DRAIN_SCHEDULED_KEY = "search:drain-scheduled"
+DRAIN_SCHEDULED_TIMEOUT = 60 * 5
+DRAIN_LOCK_KEY = "search:drain-lock"
+DRAIN_LOCK_TIMEOUT = 60 * 10
+REBUILDING_KEY = "search:rebuilding:{}"
+REBUILD_CHANGES_KEY = "search:rebuild-changes:{}"
+# Expires in case the rebuild dies before clearing it
+REBUILD_TIMEOUT = 60 * 60 * 24
+
+# Addresses are 42 characters, aliases at most 20
+prefix_ngram = token_filter("prefix_ngram", "edge_ngram", min_gram=1, max_gram=42)
+address_prefix = analyzer(
+    "address_prefix", tokenizer="keyword", filter=["lowercase", prefix_ngram]
+)
+address_search = analyzer("address_search", tokenizer="keyword", filter=["lowercase"])
+alias_prefix = analyzer(
+    "alias_prefix", tokenizer="standard", filter=["lowercase", prefix_ngram]
+)
+
 
 class FolderDocument(Document):
     folder_name = Text(analyzer="english")
     id = Long()
+    user_id = Long()
+
+    @classmethod
+    def get_id(self, pk):
+        return f"FOLDER-{pk}"
 
     @classmethod
     def from_folder(self, folder):
-        doc = self(id=folder.pk, folder_name=folder.folder_name)
-        doc.meta.id = f"FOLDER-{folder.pk}"
-        doc.save()
+        doc = self(id=folder.pk, user_id=folder.user_id, folder_name=folder.folder_name)
+        doc.meta.id = self.get_id(folder.pk)
+        return doc
 
     class Index:
         name = "etherjin"
 
 
-def update_folder_document(folder_id):
+class AliasDocument(Document):
+    """
+    Saved address of a user, searchable by the prefix of its alias or address
+    """
+
+    id = Long()
+    user_id = Long()
+    address = Text(analyzer=address_prefix, search_analyzer=address_search)
+    alias = Text(analyzer=alias_prefix, search_analyzer="standard")
+
+    @classmethod
+    def get_id(self, pk):
+        return f"ALIAS-{pk}"
+
+    @classmethod
+    def from_relationship(self, relationship):
+        doc = self(
+            id=relationship.pk,
+            user_id=relationship.user_id,
+            address=relationship.address_id,
+            alias=relationship.alias,
+        )
+        doc.meta.id = self.get_id(relationship.pk)
+        return doc
+
+    class Index:
+        name = "etherjin-aliases"
+
+
+class TransactionDocument(Document):
+    """
+    Transaction of a saved address searchable by the prefix of its counterparty
+    Filtered by the saved addresses of a user
+    """
+
+    hash = Keyword()
+    address = Keyword()
+    counterparty = Text(analyzer=address_prefix, search_analyzer=address_search)
+    direction = Keyword()
+    value_in_ether = Double()
+    block_number = Long()
+    timestamp = Date()
+    is_error = Boolean()
+
+    @classmethod
+    def from_link(self, link):
+        """
+        Takes in an address transaction with its transaction
+        A transfer between two saved addresses has a document for each of them
+        """
+        transaction = link.transaction
+        doc = self(
+            hash=transaction.hash,
+            address=link.address_id,
+            counterparty=link.counterparty,
+            direction=link.direction,
+            value_in_ether=float(transaction.value_in_ether),
+            block_number=transaction.block_number,
+            timestamp=transaction.timestamp,
+            is_error=transaction.is_error,
+        )
+        doc.meta.id = link.pk
+        return doc
+
+    class Index:
+        name = "etherjin-transactions"
+        settings = {"refresh_interval": "5s"}
+
+
+def bulk_index(actions, kind, refresh="wait_for"):
+    """
+    Takes in bulk actions and the kind of their documents
+    Sends them in requests of ELASTICSEARCH_BULK_SIZE, refreshing once per request
+    Returns the number of documents written
+    """
+    with SEARCH_INDEX_SECONDS.time(kind=kind):
+        indexed_count, errors = bulk(
+            connections.get_connection(),
+            actions,
+            chunk_size=settings.ELASTICSEARCH_BULK_SIZE,
+            refresh=refresh,
+            ignore_status=404,
+        )
+    SEARCH_INDEX_DOCUMENTS.inc(indexed_count, kind=kind)
+    return indexed_count
+
+
+def log_rebuild_changes(kind, ids):
+    """
+    Takes in an indexed kind and the ids of the instances about to be indexed
+    While a new index of the kind loads, writes still go to the old one through the
+    alias, so their ids are recorded to be indexed again once the new one is live
+    """
+    redis = get_redis_connection("default")
+    if not redis.exists(REBUILDING_KEY.format(kind)):
+        return
+    ids = list(ids)
+    if ids:
+        pipe = redis.pipeline()
+        pipe.sadd(REBUILD_CHANGES_KEY.format(kind), *ids)
+        pipe.expire(REBUILD_CHANGES_KEY.format(kind), REBUILD_TIMEOUT)
+        pipe.execute()
+
+
+def iter_sync_actions(documents, ids, document_class):
+    """
+    Takes in the documents of the existing instances, the requested ids and their class
+    Yields their index actions, then a delete action for each deleted instance
+    """
+    ids = set(ids)
+    for doc in documents:
+        ids.discard(doc.id)
+        yield doc.to_dict(include_meta=True)
+    for pk in ids:
+        yield {
+            "_op_type": "delete",
+            "_index": document_class._index._name,
+            "_id": document_class.get_id(pk),
+        }
+
+
+def index_folders(folder_ids):
+    """
+    Takes in folder ids
+    Indexes or deletes their documents in bulk
+    Returns the number of documents written
+    """
     from etherscan_app.models import Folder
 
-    folder = Folder.objects.filter(pk=folder_id).first()
-    if folder:
-        logger.info("Updating the index for {folder}")
-        FolderDocument.from_folder(folder)
+    log_rebuild_changes("folders", folder_ids)
+    folders = Folder.objects.filter(pk__in=folder_ids).only("user", "folder_name")
+    documents = (
+        FolderDocument.from_folder(x)
+        for x in folders.iterator(chunk_size=settings.ELASTICSEARCH_BULK_SIZE)
+    )
+    indexed_count = bulk_index(
+        iter_sync_actions(documents, folder_ids, FolderDocument), "folders"
+    )
+    logger.info(f"Indexed {indexed_count} folders")
+    return indexed_count
+
+
+def index_aliases(relationship_ids):
+    """
+    Takes in AddressUserRelationship ids
+    Indexes or deletes their documents in bulk
+    Returns the number of documents written
+    """
+    from etherscan_app.models import AddressUserRelationship
+
+    log_rebuild_changes("aliases", relationship_ids)
+    relationships = AddressUserRelationship.objects.filter(pk__in=relationship_ids)
+    documents = (
+        AliasDocument.from_relationship(x)
+        for x in relationships.iterator(chunk_size=settings.ELASTICSEARCH_BULK_SIZE)
+    )
+    indexed_count = bulk_index(
+        iter_sync_actions(documents, relationship_ids, AliasDocument), "aliases"
+    )
+    logger.info(f"Indexed {indexed_count} aliases")
+    return indexed_count
+
+
+def index_transactions(links):
+    """
+    Takes in an address transaction queryset
+    Indexes its documents in bulk, leaving the refresh to the refresh interval
+    Returns the number of documents written
+    """
+    log_rebuild_changes("transactions", links.values_list("pk", flat=True))
+    links = links.select_related("transaction").iterator(
+        chunk_size=settings.ELASTICSEARCH_BULK_SIZE
+    )
+    documents = (
+        TransactionDocument.from_link(x).to_dict(include_meta=True) for x in links
+    )
+    return bulk_index(documents, "transactions", refresh=False)
+
+
+def index_links(link_ids):
+    """
+    Takes in AddressTransaction ids
+    Indexes their documents in bulk
+    Returns the number of documents written
+    """
+    from etherscan_app.models import AddressTransaction
+
+    return index_transactions(AddressTransaction.objects.filter(pk__in=link_ids))
+
+
+@flushes_metrics
+def index_address_transactions(address, start_block=0):
+    """
+    Takes in an address and the first block of the transactions to index
+    Runs after its transactions are ingested
+    """
+    from etherscan_app.models import AddressTransaction
+
+    links = AddressTransaction.objects.filter(
+        address=address, block_number__gte=start_block
+    )
+    indexed_count = index_transactions(links)
+    logger.info(f"Indexed {indexed_count} transactions of {address}")
+    return indexed_count
+
+
+IndexSource = namedtuple("IndexSource", "kind queryset get_document index_ids")
+
+
+def get_index_sources():
+    """
+    Returns the source of each document type: its kind, its queryset, the function
+    building its documents and the function indexing instances by id
+    """
+    from etherscan_app.models import (AddressTransaction,
+                                      AddressUserRelationship, Folder)
+
+    return {
+        FolderDocument: IndexSource(
+            "folders",
+            Folder.objects.only("user", "folder_name"),
+            FolderDocument.from_folder,
+            index_folders,
+        ),
+        AliasDocument: IndexSource(
+            "aliases",
+            AddressUserRelationship.objects.all(),
+            AliasDocument.from_relationship,
+            index_aliases,
+        ),
+        TransactionDocument: IndexSource(
+            "transactions",
+            AddressTransaction.objects.select_related("transaction"),
+            TransactionDocument.from_link,
+            index_links,
+        ),
+    }
+
+
+def swap_alias(alias, index_name):
+    """
+    Takes in an alias and the index it should point to
+    Moves the alias in one atomic request
+    Returns the indices it pointed to before
+    """
+    client = connections.get_connection()
+    old_indices = []
+    actions = []
+    if client.indices.exists_alias(name=alias):
+        old_indices = list(client.indices.get_alias(name=alias))
+        actions += [{"remove": {"index": x, "alias": alias}} for x in old_indices]
+    elif client.indices.exists(index=alias):
+        # Index created before aliases were used, it can't share the alias name
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index_name, "alias": alias}})
+    client.indices.update_aliases(body={"actions": actions})
+    return old_indices
+
+
+def rebuild_index(
+    document_class, shards=1, replicas=1, refresh_interval=None, threads=4
+):
+    """
+    Takes in a document class and the settings of its new index
+    Loads a new versioned index from the database, then points the alias to it
+    Searches keep using the old index until the swap, and instances indexed meanwhile
+    are indexed again into the new one after it
+    Returns the new index name, the old indices and the number of documents loaded
+    """
+    source = get_index_sources()[document_class]
+    alias = document_class._index._name
+    # Two rebuilds started in the same second don't collide
+    index_name = f"{alias}-{timezone.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+    if refresh_interval is None:
+        refresh_interval = document_class._index._settings.get("refresh_interval", "1s")
+
+    redis = get_redis_connection("default")
+    rebuilding_key = REBUILDING_KEY.format(source.kind)
+    changes_key = REBUILD_CHANGES_KEY.format(source.kind)
+    redis.set(rebuilding_key, index_name, ex=REBUILD_TIMEOUT)
+    index = document_class._index.clone(name=index_name)
+    # Replicas and refreshes only slow the load down, they're set once it's done
+    index.settings(number_of_shards=shards, number_of_replicas=0, refresh_interval="-1")
+    index.create()
+
+    try:
+        actions = (
+            {**source.get_document(x).to_dict(include_meta=True), "_index": index_name}
+            for x in source.queryset.iterator(
+                chunk_size=settings.ELASTICSEARCH_BULK_SIZE
+            )
+        )
+        indexed_count = 0
+        for ok, item in parallel_bulk(
+            connections.get_connection(),
+            actions,
+            thread_count=threads,
+            chunk_size=settings.ELASTICSEARCH_BULK_SIZE,
+        ):
+            indexed_count += ok
+
+        index.put_settings(
+            body={"number_of_replicas": replicas, "refresh_interval": refresh_interval}
+        )
+        index.refresh()
+        old_indices = swap_alias(alias, index_name)
+    except Exception:
+        # e.g. a BulkIndexError, the half loaded index is never used
+        redis.delete(rebuilding_key, changes_key)
+        index.delete(ignore=404)
+        raise
+
+    # Writes from now on go to the new index, the ones logged before are redone
+    pipe = redis.pipeline()
+    pipe.delete(rebuilding_key)
+    pipe.smembers(changes_key)
+    pipe.delete(changes_key)
+    _, changed_ids, _ = pipe.execute()
+    logger.info(f"Loaded {indexed_count} documents into {index_name}")
+    if changed_ids:
+        source.index_ids(sorted(int(x) for x in changed_ids))
+        logger.info(f"Indexed {len(changed_ids)} documents changed during the load")
+    return index_name, old_indices, indexed_count
+
+
+def get_indexers():
+    return {"folders": index_folders, "aliases": index_aliases}
+
+
+def schedule_drain():
+    """
+    Schedules drain_dirty_documents unless it's already scheduled
+    The delay lets a burst of changes be indexed by a single drain
+    """
+    redis = get_redis_connection("default")
+    # Expires in case the scheduled drain is lost
+    timeout = settings.SEARCH_INDEX_DEBOUNCE + DRAIN_SCHEDULED_TIMEOUT
+    if redis.set(DRAIN_SCHEDULED_KEY, 1, nx=True, ex=timeout):
+        TASKS_QUEUED.inc(task="index-drain")
+        schedule(
+            "etherscan_app.indexes.drain_dirty_documents",
+            schedule_type=Schedule.ONCE,
+            next_run=timezone.now() + timedelta(seconds=settings.SEARCH_INDEX_DEBOUNCE),
+        )
+
+
+def mark_dirty(kind, ids):
+    """
+    Takes in an indexed kind like folders and the ids of changed instances
+    Records them in Redis until the next drain indexes them
+    """
+    redis = get_redis_connection("default")
+    redis.sadd(DIRTY_KEY.format(kind), *ids)
+    schedule_drain()
+
+
+@flushes_metrics
+def drain_dirty_documents():
+    """
+    Indexes the dirty instances of each kind in bulk
+    Ids marked several times are indexed once, from their state at the drain
+    Returns the number of documents written
+    """
+    redis = get_redis_connection("default")
+    indexed_count = 0
+    # A drain writing older states after a newer drain would undo its changes
+    with redis.lock(DRAIN_LOCK_KEY, timeout=DRAIN_LOCK_TIMEOUT):
+        # Instances marked from now on are left to the next drain
+        redis.delete(DRAIN_SCHEDULED_KEY)
+        for kind, index in get_indexers().items():
+            pipe = redis.pipeline()
+            pipe.smembers(DIRTY_KEY.format(kind))
+            pipe.delete(DIRTY_KEY.format(kind))
+            ids, _ = pipe.execute()
+            if not ids:
+                continue
+            ids = sorted(int(x) for x in ids)
+            try:
+                indexed_count += index(ids)
+            except Exception:
+                logger.exception(f"Failed to index {len(ids)} {kind}")
+                mark_dirty(kind, ids)
+                raise
+    return indexed_count
+
+
+# Instances changed in the current transaction of each connection of the thread,
+# by connection alias and kind
+pending_indexing = threading.local()
+
+
+def get_pending_indexing(alias):
+    if not hasattr(pending_indexing, "ids"):
+        pending_indexing.ids = {}
+    return pending_indexing.ids.setdefault(alias, defaultdict(set))
+
+
+def mark_pending_dirty(alias):
+    """
+    Commit hook marking the instances changed on the connection dirty at once
+    """
+    pending = get_pending_indexing(alias)
+    del pending_indexing.ids[alias]
+    for kind, ids in pending.items():
+        mark_dirty(kind, ids)
+
+
+def queue_indexing(kind, pk):
+    """
+    Takes in an indexed kind and the id of a saved or deleted instance
+    Marks it dirty once the current transaction commits
+    """
+    alias = transaction.get_connection().alias
+    get_pending_indexing(alias)[kind].add(pk)
+    # A rolled back savepoint drops its hooks, so every change adds one. The first
+    # to run empties the queue and the others return without reaching Redis. Ids
+    # left by a rolled back transaction are reindexed from their saved state
+    transaction.on_commit(partial(mark_pending_dirty, alias))
+
+
+def queue_folder_indexing(folder_id):
+    queue_indexing("folders", folder_id)
 
 
-def delete_folder_document(folder_id):
-    doc = FolderDocument()
-    doc.meta.id = f"FOLDER-{folder_id}"
-    doc.delete(ignore=404)
+def queue_alias_indexing(relationship_id):
+    queue_indexing("aliases", relationship_id)
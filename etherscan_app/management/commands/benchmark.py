@@ -0,0 +1,88 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from django.utils import timezone
+
+from etherscan_app.benchmark import benchmark_ingest, benchmark_views
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure ingest throughput and view latency on synthetic data "
+        "in a separate test database, against a local fake Etherscan"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenarios",
+            nargs="+",
+            choices=["ingest", "views"],
+            default=["ingest", "views"],
+        )
+        parser.add_argument(
+            "--ingest-size",
+            type=int,
+            default=10000,
+            help="Transactions ingested from the fake Etherscan",
+        )
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10000, 100000, 1000000],
+            help="Transactions of the address whose pages are requested",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=50, help="Requests per view and size"
+        )
+        parser.add_argument("--output", help="File the JSON report is written to")
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Keep the test database between runs",
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+        report = {
+            "generated_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "parameters": {
+                x: options[x] for x in ["scenarios", "ingest_size", "sizes", "repeat"]
+            },
+        }
+
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            if "ingest" in options["scenarios"]:
+                report["ingest"] = benchmark_ingest(options["ingest_size"])
+                self.stderr.write(f"Ingest: {report['ingest']}")
+            if "views" in options["scenarios"]:
+                report["views"] = {}
+                for size in options["sizes"]:
+                    report["views"][size] = benchmark_views(size, options["repeat"])
+                    self.stderr.write(f"Views at {size}: {report['views'][size]}")
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+            self.stdout.write(
+                self.style.SUCCESS(f"Report written to {options['output']}")
+            )
+        else:
+            self.stdout.write(output)
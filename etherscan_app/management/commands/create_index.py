@@ -1,15 +1,69 @@
-from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from elasticsearch_dsl import Index
+from elasticsearch_dsl import connections
 
-from etherscan_app.indexes import FolderDocument
+from etherscan_app.indexes import (AliasDocument, FolderDocument,
+                                   TransactionDocument, rebuild_index)
+
+DOCUMENTS = {
+    "folders": FolderDocument,
+    "aliases": AliasDocument,
+    "transactions": TransactionDocument,
+}
 
 
 class Command(BaseCommand):
+    help = "Rebuild the search indexes from the database without a search outage"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "documents",
+            nargs="*",
+            help=f"Indexes to rebuild among {', '.join(DOCUMENTS)}, all by default",
+        )
+        parser.add_argument("--shards", type=int, default=1)
+        parser.add_argument(
+            "--replicas",
+            type=int,
+            default=1,
+            help="Replicas of the new index, added once it's loaded",
+        )
+        parser.add_argument(
+            "--refresh-interval",
+            help="Refresh interval of the new index once it's loaded",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=4,
+            help="Number of bulk requests sent at the same time",
+        )
+        parser.add_argument(
+            "--keep-old",
+            action="store_true",
+            help="Keep the previous indexes instead of deleting them",
+        )
+
     def handle(self, *args, **options):
-        index = Index(settings.ELASTICSEARCH_INDEX)
-        index.delete(ignore=404)
-        index.document(FolderDocument)
-        index.create()
-        self.stdout.write(self.style.SUCCESS(f"{index} index successfully created!"))
+        unknown = set(options["documents"]) - set(DOCUMENTS)
+        if unknown:
+            raise CommandError(f"Unknown indexes: {', '.join(sorted(unknown))}")
+
+        client = connections.get_connection()
+        for name in options["documents"] or DOCUMENTS:
+            index_name, old_indices, indexed_count = rebuild_index(
+                DOCUMENTS[name],
+                shards=options["shards"],
+                replicas=options["replicas"],
+                refresh_interval=options["refresh_interval"],
+                threads=options["threads"],
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{index_name} index successfully created with "
+                    f"{indexed_count} {name}!"
+                )
+            )
+            if old_indices and not options["keep_old"]:
+                client.indices.delete(index=",".join(old_indices))
+                self.stdout.write(f"Deleted {', '.join(old_indices)}")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from etherscan_app.utils import rebuild_address_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the transaction totals of the saved addresses"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "addresses", nargs="*", help="Addresses to rebuild, all of them by default"
+        )
+
+    def handle(self, *args, **options):
+        rebuilt_count = rebuild_address_stats(options["addresses"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Totals of {rebuilt_count} addresses are rebuilt.")
+        )
@@ -1,23 +1,119 @@
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
+from etherscan_app.client import EtherscanError
 from etherscan_app.models import Address
-from etherscan_app.utils import (create_or_update_transaction,
-                                 get_address_response)
+from etherscan_app.utils import sync_address_transactions
+
+
+def datetime_argument(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"{value} isn't an ISO datetime")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def update_address(address, start_block):
+    """
+    Runs in a worker thread
+    Returns the number of new transactions of the address
+    """
+    try:
+        return sync_address_transactions(address, start_block=start_block)
+    finally:
+        # Worker threads open their own connections
+        connection.close()
 
 
 class Command(BaseCommand):
     help = "Update the saved addresses with their transaction data"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Refetch the whole history instead of the blocks after the synced block",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of addresses updated at the same time",
+        )
+        parser.add_argument(
+            "--since",
+            type=datetime_argument,
+            help="Only update addresses updated at or after this ISO datetime",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            help="Only update addresses that haven't been updated for this many hours",
+        )
+
+    def get_addresses(self, options):
+        addresses_list = Address.objects.only("address", "synced_block")
+        if options["since"]:
+            addresses_list = addresses_list.filter(updated_at__gte=options["since"])
+        if options["stale_after"] is not None:
+            stale_at = timezone.now() - timedelta(hours=options["stale_after"])
+            addresses_list = addresses_list.filter(updated_at__lt=stale_at)
+        return addresses_list.order_by("updated_at").iterator(chunk_size=1000)
+
     def handle(self, *args, **options):
         if not os.getenv("ETHERSCAN_API_TOKEN"):
             raise CommandError("API_TOKEN isn't provided")
+        concurrency = options["concurrency"]
+        if concurrency < 1:
+            raise CommandError("--concurrency must be at least 1")
+
+        started_at = time.monotonic()
+        updated_count = failed_count = transaction_count = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = {}
+            addresses_list = self.get_addresses(options)
+            while True:
+                # Keep the pool busy without queueing every address in memory
+                for address_obj in addresses_list:
+                    start_block = 0 if options["full"] else address_obj.start_block
+                    future = executor.submit(
+                        update_address, address_obj.pk, start_block
+                    )
+                    pending[future] = address_obj.pk
+                    if len(pending) >= concurrency * 2:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    address = pending.pop(future)
+                    try:
+                        transaction_count += future.result()
+                    except EtherscanError as e:
+                        failed_count += 1
+                        self.stderr.write(
+                            self.style.ERROR(f"{address} failed to update: {e}")
+                        )
+                        continue
+                    updated_count += 1
+                    self.stdout.write(
+                        self.style.SUCCESS(f"{address} is successfully updated.")
+                    )
 
-        addresses_list = Address.objects.all()
-        for address_obj in addresses_list:
-            address = address_obj.pk
-            _, response_data = get_address_response(address)
-            result_data = response_data["result"]
-            create_or_update_transaction(address, result_data)
-            self.stdout.write(self.style.SUCCESS(f"{address} is successfully updated."))
+        elapsed = max(time.monotonic() - started_at, 0.001)
+        self.stdout.write(
+            f"Updated {updated_count} addresses ({failed_count} failed) "
+            f"and saved {transaction_count} transactions in {elapsed:.1f}s "
+            f"({updated_count / elapsed:.2f} addresses/s, "
+            f"{transaction_count / elapsed:.1f} transactions/s)"
+        )
@@ -0,0 +1,377 @@
+import asyncio
+import atexit
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+from asgiref.sync import sync_to_async
+from django_q.brokers import get_broker
+from django_redis import get_redis_connection
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import (CounterMetricFamily, GaugeMetricFamily,
+                                    HistogramMetricFamily)
+from redis.exceptions import RedisError
+
+from etherscan_app.ratelimit import get_wait_metrics
+
+logger = logging.getLogger(__name__)
+
+# The web and django-q containers don't share memory, so their metrics are
+# added up in Redis and read back when Prometheus scrapes /metrics
+METRICS_KEY = "metrics:{}"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = []
+
+
+class MetricsBuffer:
+    """
+    Adds up the observations of the process in memory and sends them to Redis in one
+    round trip at most every METRICS_FLUSH_INTERVAL seconds, so no request waits on it
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.increments = {}
+        self.timer = None
+
+    def hincrby(self, key, field, amount):
+        self.add("hincrby", key, field, amount)
+
+    def hincrbyfloat(self, key, field, amount):
+        self.add("hincrbyfloat", key, field, amount)
+
+    def add(self, command, key, field, amount):
+        with self.lock:
+            name = (command, key, field)
+            self.increments[name] = self.increments.get(name, 0) + amount
+            if self.timer is None:
+                self.timer = threading.Timer(
+                    settings.METRICS_FLUSH_INTERVAL, self.flush
+                )
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """
+        Sends the buffered observations, keeping them for the next flush if Redis
+        can't be reached
+        """
+        with self.lock:
+            increments, self.increments = self.increments, {}
+            self.timer = None
+        if not increments:
+            return
+        pipeline = get_redis_connection("default").pipeline(transaction=False)
+        for (command, key, field), amount in increments.items():
+            getattr(pipeline, command)(key, field, amount)
+        try:
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning(f"Failed to record metrics: {e}")
+            for (command, key, field), amount in increments.items():
+                self.add(command, key, field, amount)
+
+
+BUFFER = MetricsBuffer()
+# Sends the last interval of the web processes. django-q workers leave through
+# os._exit when they're recycled or killed, skipping it, so tasks flush themselves
+atexit.register(BUFFER.flush)
+
+
+def flushes_metrics(task):
+    """
+    Decorates a django-q task to send the buffered metrics once it returns or raises
+    """
+
+    @wraps(task)
+    def wrapper(*args, **kwargs):
+        try:
+            return task(*args, **kwargs)
+        finally:
+            BUFFER.flush()
+
+    return wrapper
+
+
+class Metric(ABC):
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.key = METRICS_KEY.format(name)
+        METRICS.append(self)
+
+    def get_field(self, labels, *suffix):
+        labelvalues = [str(labels.get(x, "")) for x in self.labelnames]
+        return json.dumps(labelvalues + list(suffix))
+
+    @abstractmethod
+    def record(self, buffer, value, labels):
+        """
+        Takes in the metrics buffer, a value and its labels
+        Adds the value to the Redis fields of the metric
+        """
+
+    def add(self, value, **labels):
+        self.record(BUFFER, value, labels)
+
+    @abstractmethod
+    def collect(self, values):
+        """
+        Takes in the fields stored in Redis
+        Returns the Prometheus metric family built from them
+        """
+
+
+class Counter(Metric):
+    def record(self, buffer, value, labels):
+        buffer.hincrbyfloat(self.key, self.get_field(labels), value)
+
+    def inc(self, amount=1, **labels):
+        self.add(amount, **labels)
+
+    def collect(self, values):
+        family = CounterMetricFamily(
+            self.name, self.documentation, labels=self.labelnames
+        )
+        for field, value in values.items():
+            family.add_metric(json.loads(field), float(value))
+        return family
+
+
+class Histogram(Metric):
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def record(self, buffer, value, labels):
+        # Buckets are stored apart and added up when they're collected
+        index = bisect_left(self.buckets, value)
+        buffer.hincrby(self.key, self.get_field(labels, "bucket", index), 1)
+        buffer.hincrbyfloat(self.key, self.get_field(labels, "sum"), value)
+
+    def observe(self, value, **labels):
+        self.add(value, **labels)
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def collect(self, values):
+        family = HistogramMetricFamily(
+            self.name, self.documentation, labels=self.labelnames
+        )
+        series = {}
+        for field, value in values.items():
+            field = json.loads(field)
+            labelvalues = tuple(field[: len(self.labelnames)])
+            kind = field[len(self.labelnames)]
+            counts, total = series.setdefault(
+                labelvalues, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            if kind == "sum":
+                total[0] = float(value)
+            else:
+                counts[field[-1]] = int(value)
+        for labelvalues, (counts, total) in series.items():
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += count
+                buckets.append((str(bound), cumulative))
+            family.add_metric(list(labelvalues), buckets, total[0])
+        return family
+
+
+ETHERSCAN_REQUEST_SECONDS = Histogram(
+    "etherjin_etherscan_request_seconds",
+    "Latency of Etherscan API requests",
+    ["action"],
+)
+ETHERSCAN_RESPONSES = Counter(
+    "etherjin_etherscan_responses_total",
+    "Etherscan API responses by HTTP status, or error when there was none",
+    ["status"],
+)
+TRANSACTIONS_INSERTED = Counter(
+    "etherjin_transactions_inserted_total",
+    "Transactions inserted by the ingest",
+)
+INGEST_BATCH_SECONDS = Histogram(
+    "etherjin_ingest_batch_seconds",
+    "Time spent saving a page of Etherscan transactions",
+)
+SEARCH_INDEX_SECONDS = Histogram(
+    "etherjin_search_index_seconds",
+    "Time spent sending documents to Elasticsearch",
+    ["kind"],
+)
+SEARCH_INDEX_DOCUMENTS = Counter(
+    "etherjin_search_index_documents_total",
+    "Documents written to Elasticsearch",
+    ["kind"],
+)
+TASKS_QUEUED = Counter(
+    "etherjin_tasks_queued_total",
+    "Background work queued by the signal handlers and views",
+    ["task"],
+)
+VIEW_SECONDS = Histogram(
+    "etherjin_view_seconds",
+    "Time spent handling requests",
+    ["view", "method", "status"],
+)
+VIEW_QUERIES = Histogram(
+    "etherjin_view_queries",
+    "Database queries run per request",
+    ["view"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+VIEW_QUERY_SECONDS = Histogram(
+    "etherjin_view_query_seconds",
+    "Time spent in database queries per request",
+    ["view"],
+)
+
+
+class RedisCollector:
+    """
+    Reads the metrics recorded by every process back from Redis
+    """
+
+    def collect(self):
+        BUFFER.flush()
+        redis = get_redis_connection("default")
+        pipeline = redis.pipeline(transaction=False)
+        for metric in METRICS:
+            pipeline.hgetall(metric.key)
+        for metric, values in zip(METRICS, pipeline.execute()):
+            values = {x.decode(): y.decode() for x, y in values.items()}
+            yield metric.collect(values)
+
+        wait_metrics = get_wait_metrics()
+        yield CounterMetricFamily(
+            "etherjin_ratelimit_calls_total",
+            "Etherscan calls that went through the rate limiter",
+            value=wait_metrics["calls"],
+        )
+        yield CounterMetricFamily(
+            "etherjin_ratelimit_throttled_calls_total",
+            "Etherscan calls that waited for a rate limit token",
+            value=wait_metrics["throttled_calls"],
+        )
+        yield CounterMetricFamily(
+            "etherjin_ratelimit_wait_seconds_total",
+            "Time spent waiting for rate limit tokens",
+            value=wait_metrics["wait_seconds"],
+        )
+        yield GaugeMetricFamily(
+            "etherjin_queue_size",
+            "Tasks waiting in the django-q queue",
+            value=get_queue_size(),
+        )
+
+
+def get_queue_size():
+    return get_broker().queue_size()
+
+
+REGISTRY = CollectorRegistry(auto_describe=False)
+REGISTRY.register(RedisCollector())
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries of a request and their time
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started_at
+
+
+class MetricsMiddleware:
+    """
+    Records the time and database queries of each request
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets Django call it as a coroutine, like its own MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            query_counter = self.stop_counting(request)
+        self.record(request, response, elapsed, query_counter)
+        return response
+
+    async def __acall__(self, request):
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            query_counter = await sync_to_async(self.stop_counting)(request)
+        self.record(request, response, elapsed, query_counter)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Under ASGI this runs in the thread of the request, like sync views and
+        # the sync_to_async calls of async views, so the counter sees their queries
+        request.query_counter = QueryCounter()
+        connection.execute_wrappers.append(request.query_counter)
+
+    def stop_counting(self, request):
+        """
+        Takes in a request
+        Removes its query counter from the connection and returns it, if it has one
+        """
+        query_counter = getattr(request, "query_counter", None)
+        if query_counter is not None:
+            connection.execute_wrappers.remove(query_counter)
+        return query_counter
+
+    def record(self, request, response, elapsed, query_counter=None):
+        resolver_match = getattr(request, "resolver_match", None)
+        view = resolver_match.view_name if resolver_match else "unresolved"
+        if view == "etherscan_app:metrics":
+            return
+        VIEW_SECONDS.observe(
+            elapsed, view=view, method=request.method, status=response.status_code
+        )
+        if query_counter is not None:
+            VIEW_QUERIES.observe(query_counter.count, view=view)
+            VIEW_QUERY_SECONDS.observe(query_counter.seconds, view=view)
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etherscan_app", "0002_alter_addressuserrelationship_alias"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="synced_block",
+            field=models.PositiveBigIntegerField(default=None, null=True),
+        ),
+    ]
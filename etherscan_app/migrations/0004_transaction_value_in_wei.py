@@ -0,0 +1,44 @@
+# Generated by Django 3.2 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def value_in_ether_to_wei(apps, schema_editor):
+    Transaction = apps.get_model("etherscan_app", "Transaction")
+    Transaction.objects.update(value_in_wei=F("value_in_ether") * 10 ** 18)
+
+
+def value_in_wei_to_ether(apps, schema_editor):
+    Transaction = apps.get_model("etherscan_app", "Transaction")
+    Transaction.objects.update(value_in_ether=F("value_in_wei") / 10 ** 18)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etherscan_app", "0003_address_synced_block"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="value_in_wei",
+            field=models.DecimalField(decimal_places=0, max_digits=78, null=True),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="value_in_ether",
+            field=models.DecimalField(decimal_places=20, max_digits=110, null=True),
+        ),
+        migrations.RunPython(value_in_ether_to_wei, value_in_wei_to_ether),
+        migrations.AlterField(
+            model_name="transaction",
+            name="value_in_wei",
+            field=models.DecimalField(decimal_places=0, max_digits=78),
+        ),
+        migrations.RemoveField(
+            model_name="transaction",
+            name="value_in_ether",
+        ),
+    ]
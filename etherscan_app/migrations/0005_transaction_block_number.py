@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 11:20
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ("etherscan_app", "0004_transaction_value_in_wei"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="block_number",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        AddIndexConcurrently(
+            model_name="transaction",
+            index=models.Index(
+                fields=["address", "block_number", "hash"],
+                name="transaction_address_block_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 3.2 on 2026-10-18 11:48
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+BATCH_SIZE = 10000
+
+
+def backfill_direction(apps, schema_editor):
+    """
+    Fills in the direction of the saved transactions a batch at a time
+    Every batch commits on its own so the table is never locked for long, and seeks
+    past the last hash of the previous one through the primary key instead of
+    scanning the table again for the rows left to fill in
+    """
+    Transaction = apps.get_model("etherscan_app", "Transaction")
+    table = Transaction._meta.db_table
+    last_hash = ""
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                f"""
+                SELECT max(hash) FROM (
+                    SELECT hash FROM {table} WHERE hash > %s ORDER BY hash LIMIT %s
+                ) AS batch
+                """,
+                [last_hash, BATCH_SIZE],
+            )
+            batch_last_hash = cursor.fetchone()[0]
+            if batch_last_hash is None:
+                break
+            cursor.execute(
+                f"""
+                UPDATE {table} SET direction = CASE
+                    WHEN lower(from_account) = lower(address_id)
+                        AND lower(to_account) = lower(address_id) THEN 'self'
+                    WHEN lower(from_account) = lower(address_id) THEN 'out'
+                    ELSE 'in'
+                END
+                WHERE hash > %s AND hash <= %s AND direction IS NULL
+                """,
+                [last_hash, batch_last_hash],
+            )
+            last_hash = batch_last_hash
+
+
+class Migration(migrations.Migration):
+
+    # Batches and concurrent index builds can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ("etherscan_app", "0005_transaction_block_number"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="timestamp",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="direction",
+            field=models.CharField(
+                choices=[("in", "In"), ("out", "Out"), ("self", "Self")],
+                max_length=4,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="gas",
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="gas_price",
+            field=models.DecimalField(decimal_places=0, max_digits=78, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="gas_used",
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="is_error",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_direction, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name="transaction",
+            index=models.Index(
+                fields=["address", "timestamp"], name="transaction_address_time_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="transaction",
+            index=models.Index(fields=["from_account"], name="transaction_from_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="transaction",
+            index=models.Index(fields=["to_account"], name="transaction_to_idx"),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.2 on 2026-10-18 12:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def create_address_stats(apps, schema_editor):
+    Address = apps.get_model("etherscan_app", "Address")
+    AddressStats = apps.get_model("etherscan_app", "AddressStats")
+    address_list = Address.objects.annotate(
+        transaction_count=Count("transactions"),
+        total_in_wei=Sum(
+            "transactions__value_in_wei",
+            filter=Q(transactions__direction__in=["in", "self"]),
+        ),
+        total_out_wei=Sum(
+            "transactions__value_in_wei",
+            filter=Q(transactions__direction__in=["out", "self"]),
+        ),
+        last_activity=Max("transactions__timestamp"),
+    )
+    AddressStats.objects.bulk_create(
+        (
+            AddressStats(
+                address_id=x.pk,
+                transaction_count=x.transaction_count,
+                total_in_wei=x.total_in_wei or 0,
+                total_out_wei=x.total_out_wei or 0,
+                last_activity=x.last_activity,
+            )
+            for x in address_list.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etherscan_app", "0006_transaction_details"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AddressStats",
+            fields=[
+                (
+                    "address",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="etherscan_app.address",
+                    ),
+                ),
+                ("transaction_count", models.PositiveBigIntegerField(default=0)),
+                (
+                    "total_in_wei",
+                    models.DecimalField(decimal_places=0, default=0, max_digits=90),
+                ),
+                (
+                    "total_out_wei",
+                    models.DecimalField(decimal_places=0, default=0, max_digits=90),
+                ),
+                ("last_activity", models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_address_stats, migrations.RunPython.noop),
+    ]
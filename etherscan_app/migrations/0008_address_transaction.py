@@ -0,0 +1,166 @@
+# Generated by Django 3.2 on 2026-10-18 13:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def link_transactions(apps, schema_editor):
+    """
+    Links every saved transaction to the address it was fetched for
+    and to the other saved addresses taking part in it
+    """
+    Transaction = apps.get_model("etherscan_app", "Transaction")
+    Address = apps.get_model("etherscan_app", "Address")
+    AddressTransaction = apps.get_model("etherscan_app", "AddressTransaction")
+    table = Transaction._meta.db_table
+    address_table = Address._meta.db_table
+    link_table = AddressTransaction._meta.db_table
+    # UNION drops the links found both ways, e.g. the sender fetching its own transfer
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {link_table}
+                (address_id, transaction_id, direction, block_number)
+            SELECT address_id, hash, CASE
+                WHEN lower(from_account) = lower(address_id)
+                    AND lower(to_account) = lower(address_id) THEN 'self'
+                WHEN lower(from_account) = lower(address_id) THEN 'out'
+                ELSE 'in'
+            END, block_number
+            FROM (
+                SELECT address_id, hash, from_account, to_account, block_number
+                FROM {table}
+                UNION
+                SELECT a.address, t.hash, t.from_account, t.to_account, t.block_number
+                FROM {table} t
+                JOIN {address_table} a ON lower(a.address) = lower(t.from_account)
+                UNION
+                SELECT a.address, t.hash, t.from_account, t.to_account, t.block_number
+                FROM {table} t
+                JOIN {address_table} a ON lower(a.address) = lower(t.to_account)
+            ) links
+            """)
+
+
+def rebuild_address_stats(apps, schema_editor):
+    """
+    Recomputes the totals, which now count the transfers saved under another address
+    """
+    Address = apps.get_model("etherscan_app", "Address")
+    AddressStats = apps.get_model("etherscan_app", "AddressStats")
+    address_list = Address.objects.annotate(
+        transaction_count=Count("transaction_links"),
+        total_in_wei=Sum(
+            "transaction_links__transaction__value_in_wei",
+            filter=Q(transaction_links__direction__in=["in", "self"]),
+        ),
+        total_out_wei=Sum(
+            "transaction_links__transaction__value_in_wei",
+            filter=Q(transaction_links__direction__in=["out", "self"]),
+        ),
+        last_activity=Max("transaction_links__transaction__timestamp"),
+    )
+    AddressStats.objects.all().delete()
+    AddressStats.objects.bulk_create(
+        (
+            AddressStats(
+                address_id=x.pk,
+                transaction_count=x.transaction_count,
+                total_in_wei=x.total_in_wei or 0,
+                total_out_wei=x.total_out_wei or 0,
+                last_activity=x.last_activity,
+            )
+            for x in address_list.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etherscan_app", "0007_addressstats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AddressTransaction",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "direction",
+                    models.CharField(
+                        choices=[("in", "In"), ("out", "Out"), ("self", "Self")],
+                        max_length=4,
+                    ),
+                ),
+                ("block_number", models.PositiveBigIntegerField()),
+                (
+                    "address",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="transaction_links",
+                        to="etherscan_app.address",
+                    ),
+                ),
+                (
+                    "transaction",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="address_links",
+                        to="etherscan_app.transaction",
+                    ),
+                ),
+            ],
+        ),
+        # The transaction table loses address_id, so there's no way back
+        migrations.RunPython(link_transactions),
+        migrations.RunPython(rebuild_address_stats),
+        migrations.RemoveIndex(
+            model_name="transaction",
+            name="transaction_address_block_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="transaction",
+            name="transaction_address_time_idx",
+        ),
+        migrations.RemoveField(
+            model_name="transaction",
+            name="address",
+        ),
+        migrations.RemoveField(
+            model_name="transaction",
+            name="direction",
+        ),
+        migrations.AddField(
+            model_name="address",
+            name="transactions",
+            field=models.ManyToManyField(
+                related_name="addresses",
+                through="etherscan_app.AddressTransaction",
+                to="etherscan_app.Transaction",
+            ),
+        ),
+        # Built once the links are copied rather than maintained row by row
+        migrations.AddIndex(
+            model_name="addresstransaction",
+            index=models.Index(
+                fields=["address", "block_number", "transaction"],
+                name="address_transaction_block_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="addresstransaction",
+            constraint=models.UniqueConstraint(
+                fields=("address", "transaction"), name="address_transaction_unique"
+            ),
+        ),
+    ]
@@ -1,23 +1,55 @@
+from decimal import Context, Decimal
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Case, When
 
 from elasticsearch_dsl import Q as ESQ
 
-from etherscan_app.indexes import FolderDocument
+from etherscan_app.indexes import (AliasDocument, FolderDocument,
+                                   TransactionDocument)
+
+WEI_CONTEXT = Context(prec=78)
+
+
+def wei_to_ether(value_in_wei):
+    return Decimal(value_in_wei).scaleb(-18, context=WEI_CONTEXT)
+
+
+def order_by_hits(queryset, hit_ids):
+    """
+    Takes in a queryset and the ids of the Elasticsearch hits
+    Returns the instances of the hits in the order of the hits
+    """
+    if not hit_ids:
+        return queryset.none()
+    hit_order = Case(*[When(pk=pk, then=i) for i, pk in enumerate(hit_ids)])
+    return queryset.filter(pk__in=hit_ids).order_by(hit_order)
+
+
+def get_search_page(search, offset, limit):
+    limit = settings.SEARCH_PAGE_SIZE if limit is None else limit
+    return search[offset : offset + limit].execute()
 
 
 class FolderQuerySet(models.QuerySet):
-    def search(self, search_query):
+    def search(self, search_query, user=None, offset=0, limit=None):
+        """
+        Takes in a search query, optionally the user owning the folders and a page
+        Returns the matching folders ordered by their Elasticsearch score
+        """
         query = ESQ(
             "multi_match",
             query=search_query,
             type="cross_fields",
             fields=["folder_name"],
         )
-
-        res = FolderDocument.search().query(query).execute()
-        folder_ids = [hit.id for hit in res.hits]
-        folders = self.filter(id__in=folder_ids)
+        search = FolderDocument.search().query(query).source(["id"])
+        if user is not None:
+            search = search.filter("term", user_id=user.pk)
+        res = get_search_page(search, offset, limit)
+        return order_by_hits(self, [hit.id for hit in res.hits])
 
 
 class Folder(models.Model):
@@ -30,11 +62,32 @@ class Folder(models.Model):
         return self.folder_name
 
 
+class AddressUserRelationshipQuerySet(models.QuerySet):
+    def search(self, search_query, user=None, offset=0, limit=None):
+        """
+        Takes in a search query, optionally the user of the addresses and a page
+        Returns the saved addresses whose alias or address starts with the query
+        """
+        query = ESQ(
+            "multi_match",
+            query=search_query,
+            operator="and",
+            fields=["alias^2", "address"],
+        )
+        search = AliasDocument.search().query(query).source(["id"])
+        if user is not None:
+            search = search.filter("term", user_id=user.pk)
+        res = get_search_page(search, offset, limit)
+        return order_by_hits(self, [hit.id for hit in res.hits])
+
+
 class AddressUserRelationship(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     address = models.ForeignKey("Address", on_delete=models.CASCADE)
     alias = models.CharField(max_length=20, null=True, default=None, unique=True)
 
+    objects = AddressUserRelationshipQuerySet.as_manager()
+
 
 class Address(models.Model):
     users = models.ManyToManyField(
@@ -44,13 +97,135 @@ class Address(models.Model):
     address = models.CharField(max_length=50, unique=True, primary_key=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    synced_block = models.PositiveBigIntegerField(null=True, default=None)
+    transactions = models.ManyToManyField(
+        "Transaction", through="AddressTransaction", related_name="addresses"
+    )
+
+    @property
+    def start_block(self):
+        """
+        The first block that hasn't been ingested yet
+        """
+        if self.synced_block is None:
+            return 0
+        return self.synced_block + 1
 
 
 class Transaction(models.Model):
-    address = models.ForeignKey(
-        Address, related_name="transactions", on_delete=models.CASCADE
-    )
+    """
+    On-chain transaction, stored once whichever tracked addresses took part in it
+    """
+
     hash = models.CharField(max_length=200, unique=True, primary_key=True)
+    block_number = models.PositiveBigIntegerField(default=0)
+    # Null for transactions saved before they were stored
+    timestamp = models.DateTimeField(null=True)
     from_account = models.CharField(max_length=50)
     to_account = models.CharField(max_length=50)
-    value_in_ether = models.DecimalField(max_digits=110, decimal_places=20)
+    # uint256 wei amounts have up to 78 digits
+    value_in_wei = models.DecimalField(max_digits=78, decimal_places=0)
+    gas = models.PositiveBigIntegerField(null=True)
+    gas_price = models.DecimalField(max_digits=78, decimal_places=0, null=True)
+    gas_used = models.PositiveBigIntegerField(null=True)
+    is_error = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Counterparty lookups
+            models.Index(fields=["from_account"], name="transaction_from_idx"),
+            models.Index(fields=["to_account"], name="transaction_to_idx"),
+        ]
+
+    @property
+    def value_in_ether(self):
+        return wei_to_ether(self.value_in_wei)
+
+
+class AddressTransactionQuerySet(models.QuerySet):
+    def search(self, search_query, addresses=None, offset=0, limit=None):
+        """
+        Takes in a counterparty prefix, optionally the addresses to search and a page
+        Returns the matching transactions of the addresses, newest block first
+        """
+        query = ESQ("match", counterparty=search_query)
+        search = TransactionDocument.search().query(query).source(False)
+        if addresses is not None:
+            search = search.filter("terms", address=list(addresses))
+        search = search.sort("-block_number")
+        res = get_search_page(search, offset, limit)
+        # Documents indexed before transactions were shared are keyed by hash,
+        # they're left out until the index is rebuilt with create_index
+        link_ids = [int(x.meta.id) for x in res.hits if x.meta.id.isdecimal()]
+        return order_by_hits(self, link_ids)
+
+
+class AddressTransaction(models.Model):
+    """
+    Role of a tracked address in a transaction
+    A transfer between two tracked addresses has a link for each of them
+    """
+
+    IN = "in"
+    OUT = "out"
+    SELF = "self"
+    DIRECTION_CHOICES = [(IN, "In"), (OUT, "Out"), (SELF, "Self")]
+
+    address = models.ForeignKey(
+        Address, related_name="transaction_links", on_delete=models.CASCADE
+    )
+    transaction = models.ForeignKey(
+        Transaction, related_name="address_links", on_delete=models.CASCADE
+    )
+    # in when the address is the receiver, out when it's the sender
+    direction = models.CharField(max_length=4, choices=DIRECTION_CHOICES)
+    # Copied from the transaction so the pages of an address are read off one index
+    block_number = models.PositiveBigIntegerField()
+
+    objects = AddressTransactionQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["address", "transaction"], name="address_transaction_unique"
+            ),
+        ]
+        indexes = [
+            # Keyset pagination of an address' transactions by block
+            models.Index(
+                fields=["address", "block_number", "transaction"],
+                name="address_transaction_block_idx",
+            ),
+        ]
+
+    @property
+    def counterparty(self):
+        """
+        The other account of the transaction, the address itself for self transfers
+        """
+        if self.direction == self.IN:
+            return self.transaction.from_account
+        return self.transaction.to_account
+
+
+class AddressStats(models.Model):
+    """
+    Totals of an address' transactions, kept up to date by the ingest
+    """
+
+    address = models.OneToOneField(
+        Address, related_name="stats", on_delete=models.CASCADE, primary_key=True
+    )
+    transaction_count = models.PositiveBigIntegerField(default=0)
+    # Self transfers count towards both totals
+    total_in_wei = models.DecimalField(max_digits=90, decimal_places=0, default=0)
+    total_out_wei = models.DecimalField(max_digits=90, decimal_places=0, default=0)
+    last_activity = models.DateTimeField(null=True)
+
+    @property
+    def total_in_ether(self):
+        return wei_to_ether(self.total_in_wei)
+
+    @property
+    def total_out_ether(self):
+        return wei_to_ether(self.total_out_wei)
@@ -0,0 +1,84 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from etherscan_app.models import AddressUserRelationship, Folder
+
+PAGE_VERSION_KEY = "page-version:{}"
+PAGE_KEY = "page:{}:{}:{}"
+
+
+def get_page_version(user_id):
+    """
+    Takes in a user
+    Returns the version of their cached pages, bumped whenever the data behind them changes
+    """
+    # A version that was evicted starts again from the clock, past the old ones
+    return cache.get_or_set(PAGE_VERSION_KEY.format(user_id), time.time_ns, None)
+
+
+def bump_page_versions(user_ids):
+    """
+    Takes in users
+    Makes every page cached for them stale
+    """
+    for user_id in set(user_ids):
+        key = PAGE_VERSION_KEY.format(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def bump_address_page_versions(addresses):
+    """
+    Takes in addresses
+    Makes the cached pages of every user who saved one of them stale
+    """
+    bump_page_versions(
+        AddressUserRelationship.objects.filter(address_id__in=addresses).values_list(
+            "user_id", flat=True
+        )
+    )
+
+
+def bump_folder_page_versions(folder_ids):
+    """
+    Takes in folders
+    Makes the cached pages of their users stale
+    """
+    bump_page_versions(
+        Folder.objects.filter(pk__in=folder_ids).values_list("user_id", flat=True)
+    )
+
+
+def cache_user_page(view):
+    """
+    Serves the successful GET responses of a view from the cache of the user
+    Views using it must render nothing that changes between sessions, like CSRF tokens
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "GET":
+            return view(request, *args, **kwargs)
+        key = PAGE_KEY.format(
+            request.user.pk,
+            get_page_version(request.user.pk),
+            request.get_full_path(),
+        )
+        page = cache.get(key)
+        if page is not None:
+            content, content_type = page
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            page = (response.content, response["Content-Type"])
+            cache.set(key, page, settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    return wrapper
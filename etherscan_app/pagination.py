@@ -0,0 +1,39 @@
+from django.db.models import Q
+
+from etherscan_app.utils import is_number
+
+
+def encode_cursor(link):
+    return f"{link.block_number}-{link.transaction_id}"
+
+
+def decode_cursor(cursor):
+    """
+    Takes in a cursor from a request
+    Returns the block number and hash it points to, or None if it's malformed
+    """
+    block_number, _, hash = (cursor or "").partition("-")
+    if not is_number(block_number) or not hash:
+        return None
+    return int(block_number), hash
+
+
+def paginate_transactions(links, cursor, page_size):
+    """
+    Takes in address transaction links, the cursor of the previous page and a page size
+    Returns the page, newest block first, and the cursor of the next page
+    Seeks from the cursor instead of using an offset so every page costs the same
+    """
+    links = links.select_related("transaction").order_by(
+        "-block_number", "-transaction"
+    )
+    position = decode_cursor(cursor)
+    if position:
+        block_number, hash = position
+        links = links.filter(
+            Q(block_number__lt=block_number)
+            | Q(block_number=block_number, transaction__lt=hash)
+        )
+    page = list(links[: page_size + 1])
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
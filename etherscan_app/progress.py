@@ -0,0 +1,98 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+ACTIVE_STATES = (PENDING, RUNNING)
+
+SYNC_STATUS_KEY = "sync-status:{}"
+# Held while a sync is pending or running, apart from the status that outlives it
+SYNC_CLAIM_KEY = "sync-claim:{}"
+SYNC_EVENTS_CHANNEL = "sync-events:{}"
+
+
+def get_sync_status(address):
+    """
+    Takes in an address
+    Returns the status of its latest transaction sync, or None if there wasn't one
+    """
+    return cache.get(SYNC_STATUS_KEY.format(address))
+
+
+def set_sync_status(address, state, **fields):
+    """
+    Takes in an address, the sync state and extra fields like the transaction count
+    Stores the status and publishes it to the pages following the sync
+    """
+    status = {"state": state, **fields}
+    # Every ingest batch sets the status again, keeping a live sync from expiring
+    if state in ACTIVE_STATES:
+        timeout = settings.SYNC_ACTIVE_STATUS_TIMEOUT
+        cache.set(SYNC_CLAIM_KEY.format(address), True, timeout)
+    else:
+        timeout = settings.SYNC_STATUS_TIMEOUT
+        cache.delete(SYNC_CLAIM_KEY.format(address))
+    cache.set(SYNC_STATUS_KEY.format(address), status, timeout)
+    publish_sync_status(address, status)
+    return status
+
+
+def claim_sync(address):
+    """
+    Takes in an address
+    Marks its sync as pending and returns True, or returns False if one already is
+    pending or running, in one step so concurrent requests can't both claim it
+    """
+    claimed = cache.add(
+        SYNC_CLAIM_KEY.format(address), True, settings.SYNC_ACTIVE_STATUS_TIMEOUT
+    )
+    if claimed:
+        set_sync_status(address, PENDING)
+    return claimed
+
+
+def publish_sync_status(address, status):
+    """
+    Sends the status out, losing it rather than failing the sync
+    """
+    try:
+        get_redis_connection("default").publish(
+            SYNC_EVENTS_CHANNEL.format(address), json.dumps(status)
+        )
+    except RedisError as e:
+        logger.warning(f"Failed to publish the sync status of {address}: {e}")
+
+
+def iter_sync_statuses(address, timeout, keepalive):
+    """
+    Takes in an address, how long to follow its sync and how long to wait for news
+    Yields its current sync status, then every new one until the sync is over,
+    and None whenever keepalive seconds pass without one
+    """
+    pubsub = get_redis_connection("default").pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(SYNC_EVENTS_CHANNEL.format(address))
+    try:
+        # Read after subscribing, so a status set in between isn't missed
+        status = get_sync_status(address) or {"state": None}
+        yield status
+        deadline = time.monotonic() + timeout
+        while status["state"] in ACTIVE_STATES and time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=keepalive)
+            if message is None:
+                yield None
+                continue
+            status = json.loads(message["data"])
+            yield status
+    finally:
+        pubsub.close()
@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "etherscan:ratelimit:metrics"
+
+# Refills the bucket from the time elapsed since the last call and takes a
+# token if there is one. Returns how long to wait for the next token otherwise.
+# The Redis clock is used so every process agrees on the time.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "timestamp")
+local tokens = tonumber(bucket[1]) or capacity
+local timestamp = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+else
+    tokens = tokens - 1
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "timestamp", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket shared through Redis by every web and django-q process
+    """
+
+    def __init__(self, name, max_calls, period):
+        self.key = f"etherscan:ratelimit:{name}"
+        self.rate = max_calls / period
+        self.capacity = max_calls
+
+    def acquire(self):
+        """
+        Blocks until a token is available
+        Returns the seconds spent waiting
+        """
+        redis = get_redis_connection("default")
+        script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        waited = 0
+        while True:
+            wait = float(script(keys=[self.key], args=[self.rate, self.capacity]))
+            if not wait:
+                break
+            time.sleep(wait)
+            waited += wait
+        record_wait(redis, waited)
+        return waited
+
+
+def record_wait(redis, waited):
+    pipeline = redis.pipeline()
+    pipeline.hincrby(METRICS_KEY, "calls", 1)
+    if waited:
+        pipeline.hincrby(METRICS_KEY, "throttled_calls", 1)
+        pipeline.hincrbyfloat(METRICS_KEY, "wait_seconds", waited)
+        logger.debug(f"Waited {waited:.3f}s for an Etherscan rate limit token")
+    pipeline.execute()
+
+
+def get_wait_metrics():
+    """
+    Returns the number of calls, throttled calls and seconds spent waiting
+    """
+    redis = get_redis_connection("default")
+    metrics = redis.hgetall(METRICS_KEY)
+    return {
+        "calls": int(metrics.get(b"calls", 0)),
+        "throttled_calls": int(metrics.get(b"throttled_calls", 0)),
+        "wait_seconds": float(metrics.get(b"wait_seconds", 0)),
+    }
+
+
+def acquire_api_token(api_tokens):
+    """
+    Takes in the pooled API tokens
+    Picks the next one round-robin and waits for its rate limit
+    Returns the API token
+    """
+    redis = get_redis_connection("default")
+    index = redis.incr("etherscan:ratelimit:next-token") % len(api_tokens)
+    api_token = api_tokens[index]
+    # Each token has its own bucket so the pool adds up their limits
+    token_id = hashlib.sha1(api_token.encode()).hexdigest()[:12]
+    bucket = TokenBucket(
+        f"token-{token_id}",
+        settings.ETHERSCAN_RATE_LIMIT["max_calls"],
+        settings.ETHERSCAN_RATE_LIMIT["period"],
+    )
+    bucket.acquire()
+    return api_token
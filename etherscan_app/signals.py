@@ -1,33 +1,54 @@
 import logging
 
-from django.db.models.signals import post_delete, post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
-from django_q.tasks import async_task
-
-from etherscan_app.models import Address, Folder
-from etherscan_app.utils import get_address_response
+from etherscan_app.indexes import queue_alias_indexing, queue_folder_indexing
+from etherscan_app.models import Address, AddressUserRelationship, Folder
+from etherscan_app.pagecache import (bump_address_page_versions,
+                                     bump_folder_page_versions,
+                                     bump_page_versions)
+from etherscan_app.utils import queue_address_sync
 
 logger = logging.getLogger(__name__)
 
 
 @receiver([post_save], sender=Address)
 def create_transactions(sender, instance, created, using, update_fields, **kwargs):
-    pk = instance.pk
-    _, response_data = get_address_response(instance.pk)
-    logger.info(f"Transaction data for {instance.address} is being saved")
-    async_task(
-        "etherscan_app.utils.create_or_update_transaction", pk, response_data["result"]
-    )
+    if queue_address_sync(instance.pk, instance.start_block):
+        logger.info(f"Transaction data for {instance.address} is being saved")
 
 
 @receiver([post_save], sender=Folder)
 def folder_saved(sender, instance, created, using, update_fields, **kwargs):
     logger.info(f"Folder {instance} is being added to the index")
-    async_task("etherscan_app.indexes.update_folder_document", instance.pk)
+    queue_folder_indexing(instance.pk)
+    transaction.on_commit(lambda: bump_page_versions([instance.user_id]))
 
 
 @receiver([post_delete], sender=Folder)
 def folder_deleted(sender, instance, using, **kwargs):
     logger.info(f"Folder {instance} is being deleted from the index")
-    async_task("etherscan_app.indexes.delete_folder_document", instance.pk)
+    queue_folder_indexing(instance.pk)
+    transaction.on_commit(lambda: bump_page_versions([instance.user_id]))
+
+
+@receiver([post_save, post_delete], sender=AddressUserRelationship)
+def alias_changed(sender, instance, using, **kwargs):
+    logger.info(f"Alias {instance.alias} of {instance.address_id} is being indexed")
+    queue_alias_indexing(instance.pk)
+    transaction.on_commit(lambda: bump_page_versions([instance.user_id]))
+
+
+@receiver([m2m_changed], sender=Address.folders.through)
+def folder_addresses_changed(sender, instance, action, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    # Cleared from the address side, pk_set doesn't say which folders lost it
+    if isinstance(instance, Folder):
+        transaction.on_commit(lambda: bump_page_versions([instance.user_id]))
+    elif pk_set:
+        transaction.on_commit(lambda: bump_folder_page_versions(pk_set))
+    else:
+        transaction.on_commit(lambda: bump_address_page_versions([instance.pk]))
@@ -0,0 +1,15 @@
+from django import template
+
+from etherscan_app.models import wei_to_ether
+
+register = template.Library()
+
+
+@register.filter
+def ether(value_in_wei):
+    """
+    Formats a wei amount in ether
+    """
+    if value_in_wei in (None, ""):
+        return ""
+    return format(wei_to_ether(value_in_wei), "f")
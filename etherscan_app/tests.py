@@ -1,54 +1,104 @@
-from unittest.mock import Mock, patch
+import csv
+import json
+import re
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import MagicMock, Mock, call, patch
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db import transaction as db_transaction
 from django.db.models import signals
-from django.test import Client, TestCase
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
+import requests
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from asgiref.wsgi import WsgiToAsgi
+from django_redis import get_redis_connection
+from elasticsearch.helpers import BulkIndexError
+from redis.exceptions import LockNotOwnedError, RedisError
 from requests.models import Response
 
-from etherscan_app.cron import update_transactions
-from etherscan_app.models import (Address, AddressUserRelationship, Folder,
-                                  Transaction)
+from etherscan_app import progress
+from etherscan_app.benchmark import (benchmark_ingest, benchmark_views,
+                                     fake_etherscan, summarize_timings)
+from etherscan_app.client import EtherscanClient, EtherscanError
+from etherscan_app.indexes import (drain_dirty_documents, index_folders,
+                                   mark_dirty, queue_folder_indexing)
+from etherscan_app.metrics import BUFFER, INGEST_BATCH_SECONDS
+from etherscan_app.models import (Address, AddressStats, AddressTransaction,
+                                  AddressUserRelationship, Folder, Transaction)
+from etherscan_app.pagecache import get_page_version
+from etherscan_app.ratelimit import (TokenBucket, acquire_api_token,
+                                     get_wait_metrics)
 from etherscan_app.utils import (create_or_update_transaction,
-                                 get_address_response)
+                                 get_address_response,
+                                 iter_address_transactions, queue_address_sync,
+                                 rebuild_address_stats,
+                                 sync_address_transactions, validate_address)
+from etherscan_project import asgi
 
 
-@patch("etherscan_app.utils.requests.get")
-class ValidateAddressTests(TestCase):
-    def setUp(self):
-        self.res = Mock(spec=Response)
-        self.user_instance = User.objects.create(username="testuser")
+def create_transaction(address_instance, direction=AddressTransaction.IN, **fields):
+    """
+    Takes in an address and the fields of a transaction
+    Saves the transaction linked to the address
+    """
+    transaction = Transaction.objects.create(**fields)
+    AddressTransaction.objects.create(
+        address=address_instance,
+        transaction=transaction,
+        direction=direction,
+        block_number=transaction.block_number,
+    )
+    return transaction
+
 
-    def test_validate_address_with_valid_address(self, request_patch):
+class ValidateAddressTests(TestCase):
+    def test_validate_address_with_valid_address(self):
         """
         Tests validate_address returns True when taking in a valid address
         """
-        patched_data = {"status": "1", "message": "OK", "result": "result data"}
-        self.res.json.return_value = patched_data
-        request_patch.return_value = self.res
-
         address = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
         valid_address, _ = validate_address(address)
         self.assertTrue(valid_address)
 
-    def test_validate_address_with_invalid_address(self, request_patch):
+    def test_validate_address_with_lowercase_address(self):
         """
-        Tests validate_address return False when taking in an invalid address
+        Tests validate_address returns True when taking in an address without checksum
         """
-        patched_data = {
-            "status": "0",
-            "message": "NOTOK",
-            "result": "Error! Invalid address format",
-        }
-        self.res.json.return_value = patched_data
-        request_patch.return_value = self.res
+        address = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+        valid_address, _ = validate_address(address)
+        self.assertTrue(valid_address)
 
+    def test_validate_address_with_invalid_address(self):
+        """
+        Tests validate_address return False when taking in an invalid address
+        """
         address = "1234567890aaazzz"
-        valid_address, response_data = validate_address(address)
+        valid_address, error = validate_address(address)
+
+        self.assertFalse(valid_address)
+        self.assertEqual(error, "Error! Invalid address format")
+
+    def test_validate_address_with_invalid_checksum(self):
+        """
+        Tests validate_address return False when the mixed case doesn't match the checksum
+        """
+        address = "0xc02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+        valid_address, error = validate_address(address)
 
         self.assertFalse(valid_address)
-        self.assertEqual(response_data["result"], "Error! Invalid address format")
+        self.assertEqual(error, "Error! Invalid address checksum")
 
 
 @patch("etherscan_app.views.validate_address")
@@ -82,36 +132,153 @@ class SubmitAddressTests(TestCase):
         """
         Tests submit_address throws 400 error when taking in an invalid address
         """
-        patched_data = {
-            "status": "0",
-            "message": "NOTOK",
-            "result": "Error! Invalid address format",
-        }
-        validate_address_patch.return_value = False, patched_data
+        error = "Error! Invalid address format"
+        validate_address_patch.return_value = False, error
 
         address = "1234567890aaazzz"
         self.client.force_login(self.user_instance)
         response = self.client.post(self.url, {"address": address})
 
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.content.decode("utf-8"), patched_data["result"])
+        self.assertEqual(response.content.decode("utf-8"), error)
 
-    def test_submit_address_with_other_errors(self, validate_address_patch):
+    @patch("etherscan_app.views.queue_address_sync")
+    def test_submit_address_with_saved_address(
+        self, queue_address_sync_patch, validate_address_patch
+    ):
         """
-        Tests submit_address throws 400 error when receiving errors from the API
+        Tests submit_address queues a sync of an already saved address
         """
+        validate_address_patch.return_value = True, None
         address = "0x8d7c9AE01050a31972ADAaFaE1A4D682F0f5a5Ca"
-        patched_data = {
-            "status": "1",
-            "message": "OK-Missing/Invalid API Key, rate limit of 1/5sec applied",
-            "result": "595623370144773018344492",
-        }
-        validate_address_patch.return_value = False, patched_data
+        Address.objects.create(address=address)
 
         self.client.force_login(self.user_instance)
-        response = self.client.post(self.url, {"address": address})
+        self.client.post(self.url, {"address": address})
 
-        self.assertEqual(response.status_code, 400)
+        queue_address_sync_patch.assert_called_once_with(address)
+
+
+class SyncStatusTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user_instance = User.objects.create(username="testuser")
+        signals.post_save.receivers = []
+        self.address = "0x8d7c9AE01050a31972ADAaFaE1A4D682F0f5a5Ca"
+        address_instance = Address.objects.create(address=self.address)
+        address_instance.users.add(self.user_instance)
+        self.url = reverse(
+            "etherscan_app:sync-status", kwargs={"address": self.address}
+        )
+
+    @patch("etherscan_app.utils.iter_address_transactions")
+    def test_sync_status_with_api_errors(self, iter_patch):
+        """
+        Tests the sync status reports the error of a failed background sync
+        """
+        iter_patch.side_effect = EtherscanError("Max rate limit reached")
+        with self.assertRaises(EtherscanError):
+            sync_address_transactions(self.address)
+
+        self.client.force_login(self.user_instance)
+        response = self.client.get(self.url)
+
+        self.assertEqual(
+            response.json(), {"state": "error", "error": "Max rate limit reached"}
+        )
+
+    @patch("etherscan_app.utils.async_task")
+    @patch("etherscan_app.utils.create_or_update_transaction", return_value=2)
+    @patch("etherscan_app.utils.iter_address_transactions", return_value=[{}])
+    def test_sync_queues_transaction_indexing(
+        self, iter_patch, create_patch, async_task_patch
+    ):
+        """
+        Tests the new transactions of a sync are indexed by one task
+        """
+        sync_address_transactions(self.address, start_block=100)
+
+        async_task_patch.assert_called_once_with(
+            "etherscan_app.indexes.index_address_transactions", self.address, 100
+        )
+
+    def test_active_sync_status_expires_sooner(self):
+        """
+        Tests a pending or running status expires unless a batch refreshes it
+        """
+        key = progress.SYNC_STATUS_KEY.format(self.address)
+        progress.set_sync_status(self.address, progress.RUNNING)
+        self.assertLessEqual(
+            caches["default"].ttl(key), settings.SYNC_ACTIVE_STATUS_TIMEOUT
+        )
+
+        progress.set_sync_status(self.address, progress.DONE)
+        self.assertGreater(
+            caches["default"].ttl(key), settings.SYNC_ACTIVE_STATUS_TIMEOUT
+        )
+
+    @patch("etherscan_app.utils.async_task")
+    def test_queue_address_sync_once(self, async_task_patch):
+        """
+        Tests an address is queued only once while its sync is pending
+        """
+        progress.set_sync_status(self.address, progress.DONE)
+        queue_address_sync(self.address)
+        queue_address_sync(self.address)
+
+        self.assertEqual(async_task_patch.call_count, 1)
+        self.client.force_login(self.user_instance)
+        self.assertEqual(self.client.get(self.url).json(), {"state": "pending"})
+
+    @patch("etherscan_app.utils.async_task")
+    def test_queue_address_sync_after_sync_finished(self, async_task_patch):
+        """
+        Tests a running sync blocks a new one until it finishes
+        """
+        progress.set_sync_status(self.address, progress.RUNNING)
+        self.assertFalse(queue_address_sync(self.address))
+
+        progress.set_sync_status(self.address, progress.ERROR, error="Timed out")
+        self.assertTrue(queue_address_sync(self.address))
+        self.assertEqual(async_task_patch.call_count, 1)
+
+    async def test_sync_status_served_asynchronously(self):
+        """
+        Tests the async status view redirects anonymous users and answers logged in ones
+        """
+        client = AsyncClient()
+        response = await client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+        progress.set_sync_status(self.address, progress.RUNNING, transactions=10)
+        await sync_to_async(client.force_login)(self.user_instance)
+        response = await client.get(self.url)
+        self.assertEqual(response.json(), {"state": "running", "transactions": 10})
+
+    def test_sync_events_stream_until_done(self):
+        """
+        Tests the events stream sends the current status, then the published ones until done
+        """
+        progress.set_sync_status(
+            self.address, progress.RUNNING, transactions=0, pages=0
+        )
+        self.client.force_login(self.user_instance)
+        response = self.client.get(
+            reverse("etherscan_app:sync-events", kwargs={"address": self.address})
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = iter(response.streaming_content)
+        self.assertEqual(
+            next(events),
+            b'data: {"state": "running", "transactions": 0, "pages": 0}\n\n',
+        )
+
+        progress.set_sync_status(self.address, progress.DONE, transactions=5, pages=1)
+        remaining = [x for x in events if not x.startswith(b":")]
+
+        self.assertEqual(
+            remaining, [b'data: {"state": "done", "transactions": 5, "pages": 1}\n\n']
+        )
 
 
 class CreateTransactionTests(TestCase):
@@ -122,10 +289,16 @@ class CreateTransactionTests(TestCase):
         )
         self.transaction_data = [
             {
+                "blockNumber": "12000000",
                 "hash": "0xmyhash",
                 "from": "0xfromaccount",
                 "to": "0xtoaccount",
-                "value": "0.0000000001",
+                "value": "100000000",
+                "timeStamp": "1616000000",
+                "gas": "21000",
+                "gasPrice": "100000000000",
+                "gasUsed": "21000",
+                "isError": "0",
             }
         ]
         self.response_data = {
@@ -141,7 +314,7 @@ class CreateTransactionTests(TestCase):
         """
         result_data = self.response_data["result"]
         create_or_update_transaction(self.address_instance.pk, result_data)
-        transactions = Transaction.objects.filter(address=self.address_instance)
+        transactions = Transaction.objects.filter(addresses=self.address_instance)
         self.assertTrue(transactions)
 
     def test_update_transaction_with_existing_address(self):
@@ -150,22 +323,27 @@ class CreateTransactionTests(TestCase):
         Updates the transaction table with the new data
         """
         fields = {
-            "address": self.address_instance,
             "hash": "0xmyhash",
             "from_account": "0xfromaccount",
             "to_account": "0xtoaccount",
-            "value_in_ether": 0.0000000001,
+            "value_in_wei": 100000000,
         }
-        Transaction.objects.create(**fields)
+        create_transaction(self.address_instance, **fields)
         transaction_count = Transaction.objects.filter(
-            address=self.address_instance
+            addresses=self.address_instance
         ).count()
 
         new_data = {
+            "blockNumber": "12000001",
             "hash": "0xanotherhash",
             "from": "0xfromaccount",
             "to": "0xtoaccount",
-            "value": "0.0000000001",
+            "value": "100000000",
+            "timeStamp": "1616000000",
+            "gas": "21000",
+            "gasPrice": "100000000000",
+            "gasUsed": "21000",
+            "isError": "0",
         }
         self.transaction_data.append(new_data)
         result_data = self.response_data["result"]
@@ -173,148 +351,1490 @@ class CreateTransactionTests(TestCase):
 
         self.assertTrue(
             transaction_count
-            < Transaction.objects.filter(address=self.address_instance).count()
+            < Transaction.objects.filter(addresses=self.address_instance).count()
         )
 
+    def test_create_transaction_advances_synced_block(self):
+        """
+        Takes in transaction data
+        Stores the highest ingested block so the next fetch starts after it
+        """
+        result_data = self.response_data["result"]
+        create_or_update_transaction(self.address_instance.pk, result_data)
+        address_instance = Address.objects.get(pk=self.address_instance.pk)
 
-class ResultsViewTests(TestCase):
-    def setUp(self):
-        self.client = Client()
-        self.user_instance = User.objects.create(username="testuser")
-        signals.post_save.receivers = []
+        self.assertEqual(address_instance.synced_block, 12000000)
+        self.assertEqual(address_instance.start_block, 12000001)
 
-    def test_results_view_with_valid_address(self):
+    def test_create_transaction_keeps_wei_precision(self):
         """
-        Takes in a valid address
-        Renders 'results.html' template with the address as context
+        Takes in a transfer too large for a float
+        Stores the exact wei value and derives the ether value from it
         """
-        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
-        Address.objects.create(address=address)
+        self.transaction_data[0]["value"] = "123456789012345678901234567"
+        result_data = self.response_data["result"]
+        create_or_update_transaction(self.address_instance.pk, result_data)
+        transaction = Transaction.objects.get(hash="0xmyhash")
 
-        url = reverse("etherscan_app:results", kwargs={"address": address})
-        self.client.force_login(self.user_instance)
-        res = self.client.get(url)
-        context_address = res.context.get("address")
+        self.assertEqual(transaction.value_in_wei, 123456789012345678901234567)
+        self.assertEqual(
+            transaction.value_in_ether, Decimal("123456789.012345678901234567")
+        )
 
-        self.assertEqual(context_address, Address.objects.last().pk)
+    def test_create_transaction_query_count_per_batch(self):
+        """
+        Takes in a small and a large page of transaction data
+        Runs the same number of queries for both
+        """
 
+        def page(size, offset):
+            return [
+                {
+                    "blockNumber": str(12000000 + i),
+                    "hash": f"0xhash{offset + i}",
+                    "from": "0xfromaccount",
+                    "to": "0xtoaccount",
+                    "value": "100",
+                    "timeStamp": "1616000000",
+                    "gas": "21000",
+                    "gasPrice": "100000000000",
+                    "gasUsed": "21000",
+                    "isError": "0",
+                }
+                for i in range(size)
+            ]
 
-class FolderRelatedTests(TestCase):
-    def setUp(self):
-        self.client = Client()
-        self.user = User.objects.create(username="testuser")
+        # The first page also creates the totals of the address
+        create_or_update_transaction(self.address_instance.pk, page(1, 0))
+        with CaptureQueriesContext(connection) as small_page_queries:
+            create_or_update_transaction(self.address_instance.pk, page(10, 1))
+        with CaptureQueriesContext(connection) as large_page_queries:
+            create_or_update_transaction(self.address_instance.pk, page(60, 11))
 
-        signals.post_save.receivers = []
-        self.address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
-        self.address_instance = Address.objects.create(address=self.address)
-        self.address_instance.users.add(self.user)
+        self.assertEqual(len(small_page_queries), len(large_page_queries))
+        self.assertEqual(Transaction.objects.count(), 71)
 
-        self.folder_name = "test_folder"
-        self.folders = ["test1", "test2", "test3"]
+    def test_create_transaction_stores_details(self):
+        """
+        Takes in a transaction sent by the address
+        Stores its time, gas and direction
+        """
+        self.transaction_data[0]["from"] = self.address_instance.pk.lower()
+        result_data = self.response_data["result"]
+        create_or_update_transaction(self.address_instance.pk, result_data)
+        transaction = Transaction.objects.get(hash="0xmyhash")
+        link = AddressTransaction.objects.get(transaction=transaction)
 
-    def test_save_address_to_folder(self):
-        folder = Folder.objects.create(user=self.user, folder_name=self.folder_name)
+        self.assertEqual(link.direction, AddressTransaction.OUT)
+        self.assertEqual(transaction.timestamp.year, 2021)
+        self.assertEqual(transaction.gas_used, 21000)
+        self.assertFalse(transaction.is_error)
 
-        url = reverse("etherscan_app:save-address-to-folder")
-        self.client.force_login(self.user)
-        self.client.post(url, {"address": self.address, "folder": folder.pk})
+    def test_create_transaction_fills_in_saved_transactions(self):
+        """
+        Takes in a transaction saved before its details were stored
+        Fills in the details
+        """
+        create_transaction(
+            self.address_instance,
+            hash="0xmyhash",
+            from_account="0xfromaccount",
+            to_account="0xtoaccount",
+            value_in_wei=100000000,
+        )
+        result_data = self.response_data["result"]
+        create_or_update_transaction(self.address_instance.pk, result_data)
+        transaction = Transaction.objects.get(hash="0xmyhash")
 
-        self.assertTrue(folder.addresses.get(address=self.address))
+        self.assertEqual(transaction.block_number, 12000000)
+        self.assertEqual(transaction.address_links.get().block_number, 12000000)
+        self.assertIsNotNone(transaction.timestamp)
 
-    def test_create_folder_without_saved_address(self):
-        url = reverse("etherscan_app:create-folder")
+    def test_create_transaction_updates_address_stats(self):
+        """
+        Takes in pages of incoming and outgoing transactions
+        Adds them to the totals of the address
+        """
+        result_data = self.response_data["result"]
+        create_or_update_transaction(self.address_instance.pk, result_data)
+        outgoing_data = {
+            **self.transaction_data[0],
+            "blockNumber": "12000001",
+            "hash": "0xanotherhash",
+            "from": self.address_instance.pk.lower(),
+            "value": "300000000",
+        }
+        create_or_update_transaction(self.address_instance.pk, [outgoing_data])
+        stats = AddressStats.objects.get(address=self.address_instance)
 
-        self.client.force_login(self.user)
-        self.client.post(url, {"folder": self.folder_name})
+        self.assertEqual(stats.transaction_count, 2)
+        self.assertEqual(stats.total_in_wei, 100000000)
+        self.assertEqual(stats.total_out_wei, 300000000)
 
-        self.assertEqual(self.folder_name, Folder.objects.last().folder_name)
+        AddressStats.objects.all().delete()
+        rebuild_address_stats()
+        rebuilt_stats = AddressStats.objects.get(address=self.address_instance)
 
-    def test_create_folder_with_saved_address(self):
-        url = reverse("etherscan_app:create-folder")
-        self.client.force_login(self.user)
-        self.client.post(url, {"folder": self.folder_name, "address": self.address})
-        self.assertEqual(Folder.objects.last().addresses.get().address, self.address)
+        self.assertEqual(rebuilt_stats.transaction_count, 2)
+        self.assertEqual(rebuilt_stats.total_in_wei, 100000000)
+        self.assertEqual(rebuilt_stats.total_out_wei, 300000000)
+        self.assertEqual(rebuilt_stats.last_activity, stats.last_activity)
 
-    def test_show_folders(self):
-        for folder in self.folders:
-            Folder.objects.create(user=self.user, folder_name=folder)
+    def test_create_transaction_skips_existing_hashes(self):
+        """
+        Takes in transaction data that is already saved
+        Doesn't duplicate or fail on the saved transactions
+        """
+        result_data = self.response_data["result"]
+        create_or_update_transaction(self.address_instance.pk, result_data)
+        create_or_update_transaction(self.address_instance.pk, result_data)
 
-        url = reverse("etherscan_app:show-folders")
-        self.client.force_login(self.user)
-        res = self.client.get(url)
-        context_lists = [x.folder_name for x in res.context.get("folders")]
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(AddressTransaction.objects.count(), 1)
+
+    def test_create_transaction_links_transfers_between_addresses(self):
+        """
+        Takes in a transfer between two saved addresses, fetched for each of them
+        Stores it once and links it to both with their own direction and totals
+        """
+        receiver = Address.objects.create(address="0x" + "1" * 40)
+        self.transaction_data[0]["from"] = self.address_instance.pk.lower()
+        self.transaction_data[0]["to"] = receiver.pk
+        result_data = self.response_data["result"]
         self.assertEqual(
-            context_lists, [x.folder_name for x in self.user.folders.all()]
+            create_or_update_transaction(self.address_instance.pk, result_data), 1
         )
+        self.assertEqual(create_or_update_transaction(receiver.pk, result_data), 1)
 
-    def test_show_folder(self):
-        folder = Folder.objects.create(user=self.user, folder_name=self.folder_name)
-        self.address_instance.folders.add(folder)
+        self.assertEqual(Transaction.objects.count(), 1)
+        links = AddressTransaction.objects.order_by("direction")
+        self.assertEqual(
+            [(x.address_id, x.direction) for x in links],
+            [
+                (receiver.pk, AddressTransaction.IN),
+                (self.address_instance.pk, AddressTransaction.OUT),
+            ],
+        )
+        self.assertEqual(receiver.stats.total_in_wei, 100000000)
+        self.assertEqual(self.address_instance.stats.total_out_wei, 100000000)
 
-        url = reverse("etherscan_app:show-folder", kwargs={"folder_id": folder.pk})
-        self.client.force_login(self.user)
-        res = self.client.get(url)
 
-        self.assertEqual(res.context.get("folder"), folder)
+@patch.dict("os.environ", {"ETHERSCAN_API_TOKEN": "token"})
+@patch("etherscan_app.client.requests.Session.get")
+class GetAddressResponseTests(TestCase):
+    def setUp(self):
+        caches["etherscan"].clear()
+
+    def test_get_address_response_from_start_block(self, request_patch):
+        """
+        Takes in an address and a start block
+        Requests only the blocks from the start block onwards
+        """
+        res = Mock(spec=Response, status_code=200)
+        res.json.return_value = {"status": "1", "message": "OK", "result": []}
+        request_patch.return_value = res
+
+        get_address_response("0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF", 12000001)
+        requested_params = request_patch.call_args.kwargs["params"]
+
+        self.assertEqual(requested_params["startblock"], 12000001)
+
+
+@patch.dict("os.environ", {"ETHERSCAN_API_TOKEN": "token"})
+@patch("etherscan_app.client.acquire_api_token", Mock(return_value="token"))
+@patch("etherscan_app.client.time.sleep")
+@patch("etherscan_app.client.requests.Session.get")
+class EtherscanClientTests(TestCase):
+    def setUp(self):
+        caches["etherscan"].clear()
+        self.ok_response = Mock(spec=Response, status_code=200)
+        self.ok_response.json.return_value = {
+            "status": "1",
+            "message": "OK",
+            "result": [],
+        }
+        self.throttled_response = Mock(spec=Response, status_code=200)
+        self.throttled_response.json.return_value = {
+            "status": "0",
+            "message": "NOTOK",
+            "result": "Max rate limit reached",
+        }
+
+    def test_get_retries_failed_calls(self, request_patch, sleep_patch):
+        """
+        Receives a server error, a throttled response and a timeout
+        Retries until the call succeeds
+        """
+        request_patch.side_effect = [
+            Mock(spec=Response, status_code=503),
+            self.throttled_response,
+            requests.Timeout(),
+            self.ok_response,
+        ]
+        response_data = EtherscanClient(retries=3).get({"module": "account"})
+
+        self.assertEqual(response_data["message"], "OK")
+        self.assertEqual(request_patch.call_count, 4)
+        self.assertEqual(sleep_patch.call_count, 3)
         self.assertEqual(
-            res.context.get("address_user_instances")[0],
-            AddressUserRelationship.objects.get(
-                user=self.user, address=self.address_instance
-            ),
+            request_patch.call_args.kwargs["timeout"], settings.ETHERSCAN_TIMEOUT
         )
 
-    def test_edit_folder_name(self):
-        folder = Folder.objects.create(user=self.user, folder_name=self.folder_name)
-        url = reverse("etherscan_app:edit-folder-name", kwargs={"folder_id": folder.pk})
-        new_name = "new_name"
+    def test_get_gives_up_after_retries(self, request_patch, sleep_patch):
+        """
+        Receives only throttled responses
+        Raises EtherscanError once the retries run out
+        """
+        request_patch.return_value = self.throttled_response
 
-        self.client.force_login(self.user)
-        self.client.post(url, {"folder_name": new_name})
+        with self.assertRaises(EtherscanError):
+            EtherscanClient(retries=2).get({"module": "account"})
+        self.assertEqual(request_patch.call_count, 3)
 
-        self.assertEqual(Folder.objects.get(pk=folder.pk).folder_name, new_name)
+    def test_get_raises_etherscan_error_on_bad_responses(
+        self, request_patch, sleep_patch
+    ):
+        """
+        Receives a client error, an HTML page and a response without a result
+        Raises EtherscanError for each of them without retrying
+        """
+        not_found_response = Mock(spec=Response, status_code=404)
+        not_found_response.raise_for_status.side_effect = requests.HTTPError("404")
+        html_response = Mock(spec=Response, status_code=200)
+        html_response.json.side_effect = ValueError("Expecting value")
+        empty_response = Mock(spec=Response, status_code=200)
+        empty_response.json.return_value = {"status": "1"}
+        for response in [not_found_response, html_response, empty_response]:
+            request_patch.reset_mock()
+            request_patch.return_value = response
+            with self.subTest(response=response), self.assertRaises(EtherscanError):
+                EtherscanClient(retries=3).get({"module": "account"})
+            self.assertEqual(request_patch.call_count, 1)
 
-    def test_delete_list(self):
-        for folder in self.folders:
-            Folder.objects.create(user=self.user, folder_name=folder)
+    @patch("etherscan_app.client.EtherscanClient.txlist")
+    def test_cached_txlist_reuses_responses(
+        self, txlist_patch, request_patch, sleep_patch
+    ):
+        """
+        Takes in the same address twice
+        Calls the API once and serves the second call from the cache
+        """
+        txlist_patch.return_value = self.ok_response.json.return_value
+        client = EtherscanClient()
+        address = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+        client.cached_txlist(address)
+        response_data = client.cached_txlist(address.lower())
 
-        url = reverse("etherscan_app:delete-folder", kwargs={"folder_id": 1})
+        self.assertEqual(response_data["message"], "OK")
+        self.assertEqual(txlist_patch.call_count, 1)
 
-        self.client.force_login(self.user)
-        self.client.get(url)
+    @patch("etherscan_app.client.EtherscanClient.txlist")
+    def test_cached_txlist_skips_errors(
+        self, txlist_patch, request_patch, sleep_patch
+    ):
+        """
+        Receives an error response
+        Doesn't cache it
+        """
+        txlist_patch.return_value = {
+            "status": "0",
+            "message": "NOTOK",
+            "result": "Error! Invalid address format",
+        }
+        client = EtherscanClient()
+        client.cached_txlist("0x")
+        client.cached_txlist("0x")
 
-        self.assertEqual(Folder.objects.all().count(), 2)
+        self.assertEqual(txlist_patch.call_count, 2)
 
+    def test_fetch_timeout_covers_every_attempt(self, request_patch, sleep_patch):
+        client = EtherscanClient(timeout=(3, 30), retries=3, backoff=0.5)
 
-@patch("etherscan_app.signals.validate_address")
-class AddressSignalsTest(TestCase):
-    def test_create_transactions_with_saved_address(self, function_patch):
-        response_data = {"status": "1", "message": "OK", "result": "result"}
-        function_patch.return_value = True, response_data
-        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
-        Address.objects.create(address=address)
+        # 4 attempts of 33s and 1s of rate limit, then up to 1.5 times 0.5+1+2s
+        self.assertEqual(client.get_fetch_timeout(), 142)
 
-        self.assertTrue(function_patch.called)
+    @patch("etherscan_app.client.EtherscanClient.txlist")
+    def test_cached_txlist_outliving_its_lock(
+        self, txlist_patch, request_patch, sleep_patch
+    ):
+        """
+        Fetches a response for longer than the lock is held
+        Returns the response all the same
+        """
+        txlist_patch.return_value = self.ok_response.json.return_value
 
+        with patch(
+            "redis.lock.Lock.release", side_effect=LockNotOwnedError("expired")
+        ) as release_patch:
+            response_data = EtherscanClient().cached_txlist("0x")
 
-class CronJobFunctionTest(TestCase):
-    @patch("etherscan_app.cron.create_or_update_transaction")
-    @patch("etherscan_app.cron.get_address_response")
-    def test_update_transactions(
-        self, get_address_response_patch, create_or_update_transaction_patch
-    ):
-        signals.post_save.receivers = []
+        self.assertEqual(release_patch.call_count, 1)
+        self.assertEqual(response_data["message"], "OK")
 
-        addresses = [
-            "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF",
-            "0x8d7c9AE01050a31972ADAaFaE1A4D682F0f5a5Ca",
+
+@patch("etherscan_app.utils.get_address_response")
+class IterAddressTransactionsTests(TestCase):
+    def page(self, *block_numbers):
+        result = [
+            {"blockNumber": str(x), "hash": f"0xhash{i}"}
+            for i, x in enumerate(block_numbers)
         ]
-        for address in addresses:
-            Address.objects.create(address=address)
-        get_address_response_patch.return_value = True, {
-            "status": "1",
-            "message": "OK",
-            "result": "result",
-        }
-        update_transactions()
+        return True, {"status": "1", "message": "OK", "result": result}
+
+    def test_iter_address_transactions_pages_on_complete_blocks(
+        self, get_address_response_patch
+    ):
+        """
+        Takes in an address with more transactions than a page
+        Yields every page without splitting a block across pages
+        """
+        get_address_response_patch.side_effect = [
+            self.page(1, 2, 3),
+            self.page(3, 3, 4),
+            self.page(4),
+        ]
+        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        pages = list(iter_address_transactions(address, page_size=3))
 
-        self.assertTrue(get_address_response_patch.called)
+        self.assertEqual(
+            [[x["blockNumber"] for x in page] for page in pages],
+            [["1", "2"], ["3", "3"], ["4"]],
+        )
+        self.assertEqual(
+            [
+                x.kwargs["start_block"]
+                for x in get_address_response_patch.call_args_list
+            ],
+            [0, 3, 4],
+        )
+
+    def test_iter_address_transactions_pages_through_a_block(
+        self, get_address_response_patch
+    ):
+        """
+        Takes in an address with more transactions in one block than a page
+        Yields every transaction of the block together, then the following blocks
+        """
+        get_address_response_patch.side_effect = [
+            self.page(5, 5, 5),
+            self.page(5, 5, 5),
+            self.page(5),
+            self.page(6),
+        ]
+        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        pages = list(iter_address_transactions(address, page_size=3))
+
+        self.assertEqual(
+            [[x["blockNumber"] for x in page] for page in pages],
+            [["5"] * 7, ["6"]],
+        )
+        self.assertEqual(
+            [x.kwargs for x in get_address_response_patch.call_args_list],
+            [
+                {"page_size": 3, "start_block": 0},
+                {"page_size": 3, "start_block": 5, "end_block": 5, "page": 2},
+                {"page_size": 3, "start_block": 5, "end_block": 5, "page": 3},
+                {"page_size": 3, "start_block": 6},
+            ],
+        )
+
+    def test_iter_address_transactions_without_transactions(
+        self, get_address_response_patch
+    ):
+        """
+        Takes in an address without transactions
+        Yields nothing
+        """
+        get_address_response_patch.return_value = False, {
+            "status": "0",
+            "message": "No transactions found",
+            "result": [],
+        }
+        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+
+        self.assertEqual(list(iter_address_transactions(address)), [])
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        redis = get_redis_connection("default")
+        for key in redis.scan_iter("etherscan:ratelimit:*"):
+            redis.delete(key)
+
+    def test_token_bucket_waits_when_empty(self):
+        """
+        Takes more tokens than the bucket holds
+        Waits for the refill and records the wait
+        """
+        bucket = TokenBucket("test", max_calls=2, period=0.1)
+        waits = [bucket.acquire() for _ in range(3)]
+
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertGreater(waits[2], 0)
+        self.assertEqual(get_wait_metrics()["throttled_calls"], 1)
+
+    def test_acquire_api_token_round_robin(self):
+        """
+        Takes in several API tokens
+        Hands them out in turn
+        """
+        api_tokens = ["token1", "token2"]
+        acquired = {acquire_api_token(api_tokens) for _ in range(2)}
+
+        self.assertEqual(acquired, set(api_tokens))
+
+
+@patch.dict("os.environ", {"ETHERSCAN_API_TOKEN": "token"})
+@patch("etherscan_app.management.commands.updateaddresses.sync_address_transactions")
+class UpdateAddressesCommandTests(TestCase):
+    def setUp(self):
+        signals.post_save.receivers = []
+        self.addresses = [
+            "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF",
+            "0x8d7c9AE01050a31972ADAaFaE1A4D682F0f5a5Ca",
+            "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2",
+        ]
+        for address in self.addresses:
+            Address.objects.create(address=address, synced_block=100)
+
+    def test_update_addresses_concurrently(self, sync_patch):
+        """
+        Updates every address from its synced block with several workers
+        Reports the number of saved transactions
+        """
+        sync_patch.return_value = 2
+        out = StringIO()
+        call_command("updateaddresses", concurrency=2, stdout=out)
+
+        self.assertEqual(
+            sorted(x.args[0] for x in sync_patch.call_args_list),
+            sorted(self.addresses),
+        )
+        self.assertTrue(
+            all(x.kwargs["start_block"] == 101 for x in sync_patch.call_args_list)
+        )
+        self.assertIn("saved 6 transactions", out.getvalue())
+
+    def test_update_addresses_stale_after(self, sync_patch):
+        """
+        Takes in a staleness in hours
+        Updates only the addresses not updated within it
+        """
+        sync_patch.return_value = 0
+        Address.objects.filter(pk=self.addresses[0]).update(
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+        call_command("updateaddresses", stale_after=24, stdout=StringIO())
+
+        self.assertEqual(
+            [x.args[0] for x in sync_patch.call_args_list], [self.addresses[0]]
+        )
+
+
+class ResultsViewTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user_instance = User.objects.create(username="testuser")
+        signals.post_save.receivers = []
+
+    def test_results_view_with_valid_address(self):
+        """
+        Takes in a valid address
+        Renders 'results.html' template with the address as context
+        """
+        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        Address.objects.create(address=address)
+
+        url = reverse("etherscan_app:results", kwargs={"address": address})
+        self.client.force_login(self.user_instance)
+        res = self.client.get(url)
+        context_address = res.context.get("address")
+
+        self.assertEqual(context_address, Address.objects.last().pk)
+
+
+@override_settings(TRANSACTIONS_PAGE_SIZE=2)
+class ShowTransactionsTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username="testuser")
+        caches["default"].clear()
+        signals.post_save.receivers = []
+        self.address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        self.address_instance = Address.objects.create(address=self.address)
+        self.address_instance.users.add(self.user)
+        for hash, block_number in [("0xa", 1), ("0xb", 2), ("0xc", 2), ("0xd", 3)]:
+            create_transaction(
+                self.address_instance,
+                hash=hash,
+                block_number=block_number,
+                from_account="0xfromaccount",
+                to_account="0xtoaccount",
+                value_in_wei=1,
+            )
+        self.url = reverse(
+            "etherscan_app:show-transactions", kwargs={"address": self.address}
+        )
+
+    def test_show_transactions_pages_by_block(self):
+        """
+        Follows the next page cursor until the last page
+        Gets every transaction once, newest block first
+        """
+        self.client.force_login(self.user)
+        hashes = []
+        cursor = None
+        while True:
+            res = self.client.get(self.url, {"after": cursor} if cursor else {})
+            hashes += [x.transaction_id for x in res.context["transactions"]]
+            cursor = res.context["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(hashes, ["0xd", "0xc", "0xb", "0xa"])
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username="testuser")
+        caches["default"].clear()
+        self.address = "0x" + "3" * 40
+        self.address_instance = Address(address=self.address)
+        # Saved without signals so no sync is queued
+        Address.objects.bulk_create([self.address_instance])
+        AddressUserRelationship.objects.create(
+            user=self.user, address=self.address_instance
+        )
+        self.transaction_data = {
+            "blockNumber": "1",
+            "hash": "0xcachedhash",
+            "from": "0xfromaccount",
+            "to": self.address,
+            "value": "1",
+            "timeStamp": "1616000000",
+            "gas": "21000",
+            "gasPrice": "100000000000",
+            "gasUsed": "21000",
+            "isError": "0",
+        }
+        self.client.force_login(self.user)
+
+    def test_show_transactions_cached_until_ingest(self):
+        """
+        Serves the repeated page from the cache
+        Renders it again once new transactions are ingested
+        """
+        create_or_update_transaction(self.address, [self.transaction_data])
+        url = reverse(
+            "etherscan_app:show-transactions", kwargs={"address": self.address}
+        )
+        with CaptureQueriesContext(connection) as rendered_queries:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as cached_queries:
+            res = self.client.get(url)
+
+        self.assertContains(res, "0xfromaccount")
+        self.assertLess(len(cached_queries), len(rendered_queries))
+        self.assertFalse([x for x in cached_queries if "etherscan_app_" in x["sql"]])
+
+        new_data = {**self.transaction_data, "hash": "0xnewhash", "from": "0xnewsender"}
+        create_or_update_transaction(self.address, [new_data])
+        self.assertContains(self.client.get(url), "0xnewsender")
+
+    @patch("etherscan_app.utils.async_task")
+    def test_backfill_makes_pages_of_linked_addresses_stale(self, async_task_patch):
+        """
+        Renders the page of another user again, and reindexes their transaction, once
+        a transaction they share is filled in by the ingest of this address
+        """
+        other_user = User.objects.create(username="otheruser")
+        other_address = Address(address="0xfromaccount")
+        Address.objects.bulk_create([other_address])
+        AddressUserRelationship.objects.create(user=other_user, address=other_address)
+        # Saved before block numbers were stored
+        create_transaction(
+            other_address,
+            direction=AddressTransaction.OUT,
+            hash="0xcachedhash",
+            from_account="0xfromaccount",
+            to_account=self.address,
+            value_in_wei=1,
+        )
+        version = get_page_version(other_user.pk)
+        updated_at = Address.objects.get(pk=other_address.pk).updated_at
+        link = AddressTransaction.objects.get(address=other_address)
+
+        create_or_update_transaction(self.address, [self.transaction_data])
+
+        self.assertNotEqual(get_page_version(other_user.pk), version)
+        self.assertGreater(
+            Address.objects.get(pk=other_address.pk).updated_at, updated_at
+        )
+        async_task_patch.assert_called_once_with(
+            "etherscan_app.indexes.index_links", [link.pk]
+        )
+
+    def test_show_folders_cached_until_folder_changes(self):
+        """
+        Renders the folder list again once an address is added to a folder
+        """
+        folder = Folder.objects.create(user=self.user, folder_name="cached")
+        url = reverse("etherscan_app:show-folders")
+        self.assertContains(self.client.get(url), "0 addresses")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address_instance.folders.add(folder)
+
+        self.assertContains(self.client.get(url), "1 addresses")
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username="testuser")
+        caches["default"].clear()
+        self.address = "0x" + "4" * 40
+        self.address_instance = Address(address=self.address)
+        Address.objects.bulk_create([self.address_instance])
+        AddressUserRelationship.objects.create(
+            user=self.user, address=self.address_instance, alias="api"
+        )
+        self.transaction_data = [
+            {
+                "blockNumber": str(i),
+                "hash": f"0xapi{i}",
+                "from": "0x" + "5" * 40,
+                "to": self.address,
+                "value": str(i * 10**18),
+                "timeStamp": str(1616000000 + i),
+                "gas": "21000",
+                "gasPrice": "100000000000",
+                "gasUsed": "21000",
+                "isError": "0",
+            }
+            for i in range(1, 4)
+        ]
+        create_or_update_transaction(self.address, self.transaction_data)
+        self.url = reverse("etherscan_app:api-transactions", kwargs={"address": "api"})
+        self.client.force_login(self.user)
+
+    def test_api_transactions_fields_and_filters(self):
+        res = self.client.get(
+            self.url,
+            {
+                "fields": "hash,value_in_wei,counterparty",
+                "min_value": str(2 * 10**18),
+                "counterparty": "0x" + "5" * 40,
+                "limit": "1",
+            },
+        )
+        data = res.json()
+
+        self.assertEqual(
+            data["results"],
+            [
+                {
+                    "hash": "0xapi3",
+                    "value_in_wei": str(3 * 10**18),
+                    "counterparty": "0x" + "5" * 40,
+                }
+            ],
+        )
+        next_page = self.client.get(data["next"]).json()
+        self.assertEqual([x["hash"] for x in next_page["results"]], ["0xapi2"])
+        self.assertIsNone(next_page["next"])
+
+    def test_api_transactions_not_modified_until_ingest(self):
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(res["Content-Encoding"], "gzip")
+        self.assertTrue(res.has_header("Last-Modified"))
+        etag = res["ETag"]
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+        new_data = {**self.transaction_data[0], "blockNumber": "4", "hash": "0xapi4"}
+        create_or_update_transaction(self.address, [new_data])
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["results"][0]["hash"], "0xapi4")
+
+    def test_api_addresses_and_folders(self):
+        folder = Folder.objects.create(user=self.user, folder_name="api")
+        self.address_instance.folders.add(folder)
+
+        addresses = self.client.get(
+            reverse("etherscan_app:api-addresses"), {"folder": folder.pk}
+        ).json()["results"]
+        folders = self.client.get(reverse("etherscan_app:api-folders")).json()[
+            "results"
+        ]
+
+        self.assertEqual(addresses[0]["alias"], "api")
+        self.assertEqual(addresses[0]["total_in_wei"], str(6 * 10**18))
+        self.assertEqual(folders[0]["address_count"], 1)
+        self.assertEqual(folders[0]["transaction_count"], 3)
+
+    def test_api_rejects_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, {"fields": "nope"}).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.url, {"since": "yesterday"}).status_code, 400
+        )
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_api_rejects_numbers_not_written_in_ascii_digits(self):
+        addresses_url = reverse("etherscan_app:api-addresses")
+        folders_url = reverse("etherscan_app:api-folders")
+        for url, params in [
+            (self.url, {"min_value": "\u00b2"}),
+            (self.url, {"max_value": "\u0663"}),
+            (self.url, {"limit": "\u00b2"}),
+            (addresses_url, {"folder": "\u00b2"}),
+            (folders_url, {"after": "\u00b2"}),
+        ]:
+            with self.subTest(url=url, params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class ExportTransactionsTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username="testuser")
+        signals.post_save.receivers = []
+        self.address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        self.address_instance = Address.objects.create(address=self.address)
+        self.address_instance.users.add(self.user)
+        self.folder = Folder.objects.create(user=self.user, folder_name="test")
+        self.address_instance.folders.add(self.folder)
+        for hash, block_number in [("0xb", 2), ("0xa", 1)]:
+            create_transaction(
+                self.address_instance,
+                hash=hash,
+                block_number=block_number,
+                from_account="0xfromaccount",
+                to_account="0xtoaccount",
+                value_in_wei=1500000000000000000,
+            )
+
+    def test_export_transactions_as_csv(self):
+        """
+        Streams the transactions of an address as CSV in block order
+        """
+        url = reverse(
+            "etherscan_app:export-transactions", kwargs={"address": self.address}
+        )
+        self.client.force_login(self.user)
+        res = self.client.get(url, {"format": "csv"})
+        rows = list(csv.DictReader(StringIO(res.getvalue().decode())))
+
+        self.assertTrue(res.streaming)
+        self.assertEqual([x["hash"] for x in rows], ["0xa", "0xb"])
+        self.assertEqual(rows[0]["value_in_ether"], "1.500000000000000000")
+
+    def test_export_folder_transactions_as_ndjson(self):
+        """
+        Streams the transactions of every address of a folder as NDJSON
+        """
+        url = reverse(
+            "etherscan_app:export-folder-transactions",
+            kwargs={"folder_id": self.folder.pk},
+        )
+        self.client.force_login(self.user)
+        res = self.client.get(url, {"format": "ndjson"})
+        rows = [json.loads(x) for x in res.getvalue().decode().splitlines()]
+
+        self.assertEqual([x["hash"] for x in rows], ["0xa", "0xb"])
+        self.assertEqual(rows[0]["address"], self.address)
+
+
+class FolderRelatedTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username="testuser")
+        caches["default"].clear()
+
+        signals.post_save.receivers = []
+        self.address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        self.address_instance = Address.objects.create(address=self.address)
+        self.address_instance.users.add(self.user)
+
+        self.folder_name = "test_folder"
+        self.folders = ["test1", "test2", "test3"]
+
+    def test_save_address_to_folder(self):
+        folder = Folder.objects.create(user=self.user, folder_name=self.folder_name)
+
+        url = reverse("etherscan_app:save-address-to-folder")
+        self.client.force_login(self.user)
+        self.client.post(url, {"address": self.address, "folder": folder.pk})
+
+        self.assertTrue(folder.addresses.get(address=self.address))
+
+    def test_create_folder_without_saved_address(self):
+        url = reverse("etherscan_app:create-folder")
+
+        self.client.force_login(self.user)
+        self.client.post(url, {"folder": self.folder_name})
+
+        self.assertEqual(self.folder_name, Folder.objects.last().folder_name)
+
+    def test_create_folder_with_saved_address(self):
+        url = reverse("etherscan_app:create-folder")
+        self.client.force_login(self.user)
+        self.client.post(url, {"folder": self.folder_name, "address": self.address})
+        self.assertEqual(Folder.objects.last().addresses.get().address, self.address)
+
+    def test_show_folders(self):
+        for folder in self.folders:
+            Folder.objects.create(user=self.user, folder_name=folder)
+
+        url = reverse("etherscan_app:show-folders")
+        self.client.force_login(self.user)
+        res = self.client.get(url)
+        context_lists = [x.folder_name for x in res.context.get("folders")]
+        self.assertEqual(
+            context_lists, [x.folder_name for x in self.user.folders.all()]
+        )
+
+    def test_show_folder(self):
+        folder = Folder.objects.create(user=self.user, folder_name=self.folder_name)
+        self.address_instance.folders.add(folder)
+
+        url = reverse("etherscan_app:show-folder", kwargs={"folder_id": folder.pk})
+        self.client.force_login(self.user)
+        res = self.client.get(url)
+
+        self.assertEqual(res.context.get("folder"), folder)
+        self.assertEqual(
+            res.context.get("address_user_instances")[0],
+            AddressUserRelationship.objects.get(
+                user=self.user, address=self.address_instance
+            ),
+        )
+
+    def test_show_folder_query_count(self):
+        """
+        Tests show_folder runs the same number of queries whatever the folder size
+        """
+        folder = Folder.objects.create(user=self.user, folder_name=self.folder_name)
+        self.address_instance.folders.add(folder)
+        url = reverse("etherscan_app:show-folder", kwargs={"folder_id": folder.pk})
+        self.client.force_login(self.user)
+
+        with CaptureQueriesContext(connection) as one_address_queries:
+            self.client.get(url)
+        # Adding the addresses makes the cached page stale once it's committed
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                address_instance = Address.objects.create(address=f"0x{i:040x}")
+                AddressUserRelationship.objects.create(
+                    user=self.user, address=address_instance, alias=f"alias{i}"
+                )
+                address_instance.folders.add(folder)
+        with CaptureQueriesContext(connection) as six_addresses_queries:
+            res = self.client.get(url)
+
+        self.assertEqual(len(res.context.get("address_user_instances")), 6)
+        self.assertEqual(len(one_address_queries), len(six_addresses_queries))
+
+    def test_edit_folder_name(self):
+        folder = Folder.objects.create(user=self.user, folder_name=self.folder_name)
+        url = reverse("etherscan_app:edit-folder-name", kwargs={"folder_id": folder.pk})
+        new_name = "new_name"
+
+        self.client.force_login(self.user)
+        self.client.post(url, {"folder_name": new_name})
+
+        self.assertEqual(Folder.objects.get(pk=folder.pk).folder_name, new_name)
+
+    def test_delete_list(self):
+        for folder in self.folders:
+            Folder.objects.create(user=self.user, folder_name=folder)
+
+        url = reverse("etherscan_app:delete-folder", kwargs={"folder_id": 1})
+
+        self.client.force_login(self.user)
+        self.client.get(url)
+
+        self.assertEqual(Folder.objects.all().count(), 2)
+
+
+DRAIN_TASK = "etherscan_app.indexes.drain_dirty_documents"
+
+
+def mock_search(folder_ids):
+    """
+    Returns a mock of Document.search() whose hits have the given ids
+    """
+    search = MagicMock()
+    for method in ["query", "source", "filter", "sort", "__getitem__"]:
+        getattr(search, method).return_value = search
+    search.execute.return_value.hits = [
+        Mock(id=x, meta=Mock(id=str(x))) for x in folder_ids
+    ]
+    return search
+
+
+class FolderSearchTests(TestCase):
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        # Deleting while scanning can skip keys
+        for key in list(self.redis.scan_iter("search:*")):
+            self.redis.delete(key)
+        self.user = User.objects.create(username="testuser")
+        self.folders = [
+            Folder.objects.create(user=self.user, folder_name=x)
+            for x in ["savings", "trading", "savings account"]
+        ]
+
+    @patch("etherscan_app.models.FolderDocument.search")
+    def test_search_keeps_score_order(self, search_patch):
+        folder_ids = [self.folders[2].pk, self.folders[0].pk]
+        search = mock_search(folder_ids)
+        search_patch.return_value = search
+
+        folders = Folder.objects.search("savings", user=self.user, offset=20, limit=10)
+
+        self.assertEqual([x.pk for x in folders], folder_ids)
+        search.filter.assert_called_once_with("term", user_id=self.user.pk)
+        search.__getitem__.assert_called_once_with(slice(20, 30))
+
+    @patch("etherscan_app.models.FolderDocument.search")
+    def test_search_without_hits(self, search_patch):
+        search_patch.return_value = mock_search([])
+
+        self.assertFalse(Folder.objects.search("nothing").exists())
+
+    @patch("etherscan_app.models.FolderDocument.search")
+    def test_search_folders_view_pages(self, search_patch):
+        search = mock_search([x.pk for x in self.folders])
+        search_patch.return_value = search
+        client = Client()
+        client.force_login(self.user)
+
+        with override_settings(SEARCH_PAGE_SIZE=2):
+            res = client.get(
+                reverse("etherscan_app:search-folders"), {"q": "savings", "page": 2}
+            )
+
+        self.assertEqual(res.context["results"], self.folders[:2])
+        self.assertTrue(res.context["has_next"])
+        search.__getitem__.assert_called_once_with(slice(2, 5))
+
+    @patch("etherscan_app.models.AliasDocument.search")
+    def test_search_aliases_of_user(self, search_patch):
+        address_instance = Address.objects.create(address="0x" + "1" * 40)
+        relationship = AddressUserRelationship.objects.create(
+            user=self.user, address=address_instance, alias="savings"
+        )
+        search = mock_search([relationship.pk])
+        search_patch.return_value = search
+
+        relationships = AddressUserRelationship.objects.search("sav", user=self.user)
+
+        self.assertEqual(list(relationships), [relationship])
+        search.filter.assert_called_once_with("term", user_id=self.user.pk)
+
+    @patch("etherscan_app.models.TransactionDocument.search")
+    def test_search_transactions_of_addresses(self, search_patch):
+        address_instance = Address.objects.create(address="0x" + "1" * 40)
+        links = [
+            create_transaction(
+                address_instance,
+                hash=f"0x{i}",
+                block_number=i,
+                from_account="0x" + "2" * 40,
+                to_account=address_instance.pk,
+                value_in_wei=0,
+            ).address_links.get()
+            for i in range(3)
+        ]
+        search = mock_search([x.pk for x in reversed(links)])
+        search_patch.return_value = search
+
+        results = AddressTransaction.objects.search(
+            "0x22", addresses=[address_instance.pk]
+        )
+
+        self.assertEqual(list(results), links[::-1])
+        self.assertEqual(results[0].counterparty, "0x" + "2" * 40)
+        search.filter.assert_called_once_with("terms", address=[address_instance.pk])
+        search.sort.assert_called_once_with("-block_number")
+
+    @patch("etherscan_app.models.TransactionDocument.search")
+    def test_search_transactions_skips_documents_keyed_by_hash(self, search_patch):
+        address_instance = Address.objects.create(address="0x" + "1" * 40)
+        link = create_transaction(
+            address_instance,
+            hash="0x1",
+            block_number=1,
+            from_account="0x" + "2" * 40,
+            to_account=address_instance.pk,
+            value_in_wei=0,
+        ).address_links.get()
+        search = mock_search([link.pk])
+        # Indexed before the index was rebuilt for shared transactions
+        search.execute.return_value.hits.insert(0, Mock(spec=[], meta=Mock(id="0x1")))
+        search_patch.return_value = search
+
+        results = AddressTransaction.objects.search("0x22")
+
+        self.assertEqual(list(results), [link])
+
+    @patch("etherscan_app.indexes.connections")
+    @patch("etherscan_app.indexes.bulk", return_value=(3, []))
+    def test_index_folders_in_one_bulk_request(self, bulk_patch, connections_patch):
+        deleted_id = self.folders[-1].pk + 1
+
+        index_folders([x.pk for x in self.folders] + [deleted_id])
+
+        bulk_patch.assert_called_once()
+        actions = list(bulk_patch.call_args[0][1])
+        self.assertEqual(
+            sorted(x["_id"] for x in actions if "_source" in x),
+            sorted(f"FOLDER-{x.pk}" for x in self.folders),
+        )
+        self.assertIn(
+            {"_op_type": "delete", "_index": "etherjin", "_id": f"FOLDER-{deleted_id}"},
+            actions,
+        )
+
+    @patch("etherscan_app.indexes.schedule")
+    def test_queue_folder_indexing_coalesces_changes(self, schedule_patch):
+        """
+        Tests the folders changed by two commits are left to one scheduled drain
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            for folder in self.folders[:2]:
+                queue_folder_indexing(folder.pk)
+            queue_folder_indexing(self.folders[0].pk)
+        mark_dirty("folders", [self.folders[2].pk])
+
+        schedule_patch.assert_called_once()
+        self.assertEqual(schedule_patch.call_args[0][0], DRAIN_TASK)
+        self.assertEqual(
+            self.redis.smembers("search:dirty:folders"),
+            {str(x.pk).encode() for x in self.folders},
+        )
+
+    @patch("etherscan_app.indexes.schedule")
+    def test_queue_folder_indexing_after_rolled_back_savepoint(self, schedule_patch):
+        """
+        Tests a change queued after a rolled back savepoint is still marked dirty
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with db_transaction.atomic():
+                    queue_folder_indexing(self.folders[0].pk)
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            queue_folder_indexing(self.folders[1].pk)
+
+        self.assertIn(
+            str(self.folders[1].pk).encode(),
+            self.redis.smembers("search:dirty:folders"),
+        )
+
+    @patch("etherscan_app.indexes.schedule")
+    @patch("etherscan_app.indexes.connections")
+    @patch("etherscan_app.indexes.bulk", return_value=(3, []))
+    def test_drain_dirty_documents_in_one_bulk_request(
+        self, bulk_patch, connections_patch, schedule_patch
+    ):
+        deleted_id = self.folders[-1].pk + 1
+        mark_dirty("folders", [x.pk for x in self.folders])
+        mark_dirty("folders", [self.folders[0].pk, deleted_id])
+
+        drain_dirty_documents()
+        drain_dirty_documents()
+
+        bulk_patch.assert_called_once()
+        actions = list(bulk_patch.call_args[0][1])
+        self.assertEqual(len(actions), 4)
+        self.assertEqual(actions[-1]["_id"], f"FOLDER-{deleted_id}")
+        self.assertFalse(self.redis.exists("search:dirty:folders"))
+
+    @patch("etherscan_app.indexes.schedule")
+    @patch("etherscan_app.indexes.index_folders", side_effect=ConnectionError)
+    def test_drain_dirty_documents_keeps_failed_ids(self, index_patch, schedule_patch):
+        mark_dirty("folders", [self.folders[0].pk])
+
+        with self.assertRaises(ConnectionError):
+            drain_dirty_documents()
+
+        self.assertEqual(
+            self.redis.smembers("search:dirty:folders"),
+            {str(self.folders[0].pk).encode()},
+        )
+        self.assertEqual(schedule_patch.call_count, 2)
+
+
+class BenchmarkTests(TestCase):
+    def test_fake_etherscan_pages_end_on_complete_blocks(self):
+        address = "0x" + "1" * 40
+        with fake_etherscan(10):
+            pages = list(iter_address_transactions(address, page_size=4))
+
+        hashes = [x["hash"] for page in pages for x in page]
+        self.assertEqual(len(set(hashes)), 10)
+        self.assertEqual([len(x) for x in pages], [3, 3, 3, 1])
+
+    def test_fake_etherscan_pages_through_a_block(self):
+        address = "0x" + "1" * 40
+        with fake_etherscan(10):
+            pages = list(iter_address_transactions(address, page_size=2))
+
+        hashes = [x["hash"] for page in pages for x in page]
+        self.assertEqual(len(set(hashes)), 10)
+        self.assertEqual([len(x) for x in pages], [3, 3, 3, 1])
+
+    @override_settings(ETHERSCAN_PAGE_SIZE=10)
+    def test_benchmark_ingest(self):
+        report = benchmark_ingest(25)
+
+        self.assertEqual(report["transactions"], 25)
+        self.assertEqual(Transaction.objects.count(), 25)
+        self.assertEqual(report["etherscan_requests"], 3)
+
+    def test_summarize_a_single_timing(self):
+        self.assertEqual(
+            summarize_timings([0.25]), {"p50_ms": 250, "p99_ms": 250, "mean_ms": 250}
+        )
+
+    def test_benchmark_with_no_repeat(self):
+        with self.assertRaises(CommandError):
+            call_command("benchmark", "--repeat", "0", stdout=StringIO())
+
+    def test_benchmark_views(self):
+        report = benchmark_views(30, repeat=3)
+
+        self.assertEqual(
+            set(report),
+            {
+                "show_transactions",
+                "show_transactions_middle_page",
+                "show_folder",
+                "show_folders",
+            },
+        )
+        self.assertGreater(report["show_transactions"]["cold"]["queries"], 0)
+        self.assertLess(
+            report["show_transactions"]["warm"]["queries"],
+            report["show_transactions"]["cold"]["queries"],
+        )
+        self.assertLessEqual(
+            report["show_folder"]["cold"]["p50_ms"],
+            report["show_folder"]["cold"]["p99_ms"],
+        )
+
+
+@patch("etherscan_app.metrics.get_queue_size", return_value=3)
+class MetricsTests(TestCase):
+    def setUp(self):
+        # Observations buffered by earlier tests are sent now and deleted below
+        BUFFER.flush()
+        redis = get_redis_connection("default")
+        for key in redis.scan_iter("metrics:*"):
+            redis.delete(key)
+        self.user = User.objects.create(username="testuser")
+
+    def get_metrics(self):
+        response = Client().get(reverse("etherscan_app:metrics"))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_metrics_record_views(self, queue_size_patch):
+        client = Client()
+        client.force_login(self.user)
+        client.get(reverse("etherscan_app:index"))
+
+        metrics = self.get_metrics()
+
+        self.assertIn(
+            'etherjin_view_seconds_count{method="GET",status="200",'
+            'view="etherscan_app:index"} 1.0',
+            metrics,
+        )
+        self.assertIn('etherjin_view_queries_count{view="etherscan_app:index"}', metrics)
+        self.assertNotIn('view="etherscan_app:metrics"', metrics)
+        self.assertIn("etherjin_queue_size 3.0", metrics)
+
+    async def test_metrics_record_queries_of_sync_views_under_asgi(
+        self, queue_size_patch
+    ):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        await client.get(reverse("etherscan_app:show-folders"))
+
+        metrics = await sync_to_async(self.get_metrics)()
+
+        query_count = re.search(
+            r'etherjin_view_queries_sum\{view="etherscan_app:show-folders"\} (\S+)',
+            metrics,
+        )
+        self.assertGreater(float(query_count.group(1)), 0)
+
+    def test_metrics_kept_while_redis_is_down(self, queue_size_patch):
+        INGEST_BATCH_SECONDS.observe(0.2)
+        with patch("etherscan_app.metrics.get_redis_connection") as redis_patch:
+            pipeline = redis_patch.return_value.pipeline.return_value
+            pipeline.execute.side_effect = RedisError("Connection refused")
+            BUFFER.flush()
+
+        metrics = self.get_metrics()
+
+        self.assertIn("etherjin_ingest_batch_seconds_count 1.0", metrics)
+
+    @patch("etherscan_app.utils.iter_address_transactions", return_value=[])
+    def test_tasks_send_their_metrics_when_they_end(
+        self, iter_address_transactions_patch, queue_size_patch
+    ):
+        signals.post_save.receivers = []
+        address = Address.objects.create(
+            address="0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        )
+        INGEST_BATCH_SECONDS.observe(0.2)
+
+        sync_address_transactions(address.pk)
+
+        self.assertEqual(BUFFER.increments, {})
+        redis = get_redis_connection("default")
+        self.assertTrue(redis.exists(INGEST_BATCH_SECONDS.key))
+
+    def test_histogram_buckets_are_cumulative(self, queue_size_patch):
+        for seconds in [0.001, 0.2, 0.3, 60]:
+            INGEST_BATCH_SECONDS.observe(seconds)
+
+        metrics = self.get_metrics()
+
+        self.assertIn('etherjin_ingest_batch_seconds_bucket{le="0.005"} 1.0', metrics)
+        self.assertIn('etherjin_ingest_batch_seconds_bucket{le="0.5"} 3.0', metrics)
+        self.assertIn('etherjin_ingest_batch_seconds_bucket{le="+Inf"} 4.0', metrics)
+        self.assertIn("etherjin_ingest_batch_seconds_sum 60.501", metrics)
+
+
+class CreateIndexCommandTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        self.folders = [
+            Folder.objects.create(user=self.user, folder_name=x)
+            for x in ["savings", "trading"]
+        ]
+        self.client = MagicMock()
+        self.client.indices.exists_alias.return_value = True
+        self.client.indices.get_alias.return_value = {"etherjin-20200101000000": {}}
+        connections_patch = patch.dict(
+            "elasticsearch_dsl.connections.connections._conns",
+            {"default": self.client},
+        )
+        connections_patch.start()
+        self.addCleanup(connections_patch.stop)
+
+    @patch("etherscan_app.indexes.timezone.now")
+    @patch("etherscan_app.indexes.parallel_bulk")
+    def test_create_index_swaps_alias_after_load(self, parallel_bulk_patch, now_patch):
+        now_patch.return_value = datetime(2021, 8, 1, tzinfo=timezone.utc)
+        actions = []
+        parallel_bulk_patch.side_effect = lambda client, items, **kwargs: [
+            (True, actions.append(x)) for x in items
+        ]
+
+        call_command("create_index", "folders", "--replicas", "2", stdout=StringIO())
+
+        index_name = actions[0]["_index"]
+        self.assertRegex(index_name, r"^etherjin-20210801000000-[0-9a-f]{8}$")
+        self.assertEqual(
+            sorted(x["_id"] for x in actions),
+            sorted(f"FOLDER-{x.pk}" for x in self.folders),
+        )
+        self.assertTrue(all(x["_index"] == index_name for x in actions))
+        create_body = self.client.indices.create.call_args[1]["body"]
+        self.assertEqual(create_body["settings"]["refresh_interval"], "-1")
+        self.client.indices.put_settings.assert_called_once_with(
+            index=index_name,
+            body={"number_of_replicas": 2, "refresh_interval": "1s"},
+        )
+        self.client.indices.update_aliases.assert_called_once_with(
+            body={
+                "actions": [
+                    {
+                        "remove": {
+                            "index": "etherjin-20200101000000",
+                            "alias": "etherjin",
+                        }
+                    },
+                    {"add": {"index": index_name, "alias": "etherjin"}},
+                ]
+            }
+        )
+        self.client.indices.delete.assert_called_once_with(
+            index="etherjin-20200101000000"
+        )
+
+    @patch("etherscan_app.indexes.bulk", return_value=(1, []))
+    @patch("etherscan_app.indexes.parallel_bulk")
+    def test_create_index_reindexes_changes_made_during_load(
+        self, parallel_bulk_patch, bulk_patch
+    ):
+        folder = self.folders[0]
+
+        def load(client, items, **kwargs):
+            loaded = [(True, x) for x in items]
+            # Written to the old index through the alias
+            Folder.objects.filter(pk=folder.pk).update(folder_name="renamed")
+            index_folders([folder.pk])
+            return loaded
+
+        parallel_bulk_patch.side_effect = load
+
+        call_command("create_index", "folders", stdout=StringIO())
+
+        self.assertEqual(bulk_patch.call_count, 2)
+        reindexed = list(bulk_patch.call_args[0][1])
+        self.assertEqual([x["_id"] for x in reindexed], [f"FOLDER-{folder.pk}"])
+        self.assertEqual(reindexed[0]["_source"]["folder_name"], "renamed")
+        redis = get_redis_connection("default")
+        self.assertFalse(redis.exists("search:rebuild-changes:folders"))
+
+    @patch("etherscan_app.indexes.parallel_bulk")
+    def test_create_index_deletes_index_that_failed_to_load(self, parallel_bulk_patch):
+        parallel_bulk_patch.side_effect = BulkIndexError("1 document(s) failed", [])
+
+        with self.assertRaises(BulkIndexError):
+            call_command("create_index", "folders", stdout=StringIO())
+
+        index_name = self.client.indices.create.call_args[1]["index"]
+        self.client.indices.delete.assert_called_once_with(
+            index=index_name, ignore=404
+        )
+        self.client.indices.update_aliases.assert_not_called()
+
+    def test_create_index_with_unknown_index(self):
+        with self.assertRaises(CommandError):
+            call_command("create_index", "wallets")
+
+
+@patch("etherscan_app.signals.queue_address_sync")
+class AddressSignalsTest(TestCase):
+    def test_create_transactions_with_saved_address(self, function_patch):
+        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        Address.objects.create(address=address)
+
+        function_patch.assert_called_once_with(address, 0)
+
+
+class SyncAddressTransactionsTest(TestCase):
+    @patch("etherscan_app.utils.async_task")
+    @patch("etherscan_app.utils.create_or_update_transaction", return_value=1)
+    @patch("etherscan_app.utils.get_address_response")
+    def test_sync_address_transactions(
+        self,
+        get_address_response_patch,
+        create_or_update_transaction_patch,
+        async_task_patch,
+    ):
+        signals.post_save.receivers = []
+
+        addresses = [
+            "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF",
+            "0x8d7c9AE01050a31972ADAaFaE1A4D682F0f5a5Ca",
+        ]
+        for address in addresses:
+            Address.objects.create(address=address)
+        get_address_response_patch.return_value = True, {
+            "status": "1",
+            "message": "OK",
+            "result": [{"blockNumber": "1"}],
+        }
+        for address in addresses:
+            sync_address_transactions(address)
+
+        self.assertEqual(get_address_response_patch.call_count, 2)
+        self.assertEqual(create_or_update_transaction_patch.call_count, 2)
+
+    @patch("etherscan_app.utils.async_task")
+    @patch("etherscan_app.utils.create_or_update_transaction", return_value=2)
+    @patch("etherscan_app.utils.get_address_response")
+    def test_sync_address_transactions_past_time_limit(
+        self,
+        get_address_response_patch,
+        create_or_update_transaction_patch,
+        async_task_patch,
+    ):
+        """
+        Takes in an address with more pages than fit in the time limit
+        Queues the indexing of the stored page and a new task for the rest
+        """
+        signals.post_save.receivers = []
+        address = "0xD4fa6E82c77716FA1EF7f5dEFc5Fd6eeeFBD3bfF"
+        Address.objects.create(address=address)
+        get_address_response_patch.return_value = True, {
+            "status": "1",
+            "message": "OK",
+            "result": [{"blockNumber": "1"}, {"blockNumber": "2"}],
+        }
+
+        created_count = sync_address_transactions(
+            address, 0, time_limit=0, created_count=3, page_count=1
+        )
+
+        self.assertEqual(created_count, 2)
+        self.assertEqual(get_address_response_patch.call_count, 1)
+        self.assertEqual(
+            async_task_patch.call_args_list,
+            [
+                call("etherscan_app.indexes.index_address_transactions", address, 0),
+                call(
+                    "etherscan_app.utils.sync_address_transactions",
+                    address,
+                    time_limit=0,
+                    created_count=5,
+                    page_count=2,
+                ),
+            ],
+        )
+        status = progress.get_sync_status(address)
+        self.assertEqual(status["state"], progress.RUNNING)
+        self.assertEqual(status["transactions"], 5)
+
+
+class AsgiApplicationTests(TestCase):
+    async def test_streaming_requests_run_in_threads_of_their_own(self):
+        """
+        Tests two streaming requests are served at the same time
+        """
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wsgi_application(environ, start_response):
+            # Passes only once both requests are in here
+            barrier.wait()
+            start_response("200 OK", [])
+            return [b""]
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "query_string": b"",
+            "headers": [],
+            "http_version": "1.1",
+            "server": ("testserver", 80),
+        }
+        with patch.object(
+            asgi, "streaming_application", WsgiToAsgi(wsgi_application)
+        ), patch.object(asgi, "is_streaming", return_value=True):
+            communicators = [
+                ApplicationCommunicator(asgi.application, scope) for _ in range(2)
+            ]
+            for communicator in communicators:
+                await communicator.send_input({"type": "http.request"})
+            for communicator in communicators:
+                response = await communicator.receive_output(10)
+                self.assertEqual(response["status"], 200)
+                # Drains the body so that no request is left hanging
+                body = await communicator.receive_output(10)
+                self.assertEqual(body["type"], "http.response.body")
+                await communicator.wait(10)
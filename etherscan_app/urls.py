@@ -1,14 +1,24 @@
 from django.urls import path
 
-from etherscan_app import views
+from etherscan_app import api, views
 
 app_name = "etherscan_app"
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("metrics", views.metrics, name="metrics"),
+    path("api/addresses", api.addresses, name="api-addresses"),
+    path(
+        "api/addresses/<str:address>/transactions",
+        api.transactions,
+        name="api-transactions",
+    ),
+    path("api/folders", api.folders, name="api-folders"),
     path("search", views.search, name="search"),
     path("submit-address", views.submit_address, name="submit-address"),
     path("results/<str:address>", views.show_results, name="results"),
+    path("results/<str:address>/status", views.sync_status, name="sync-status"),
+    path("results/<str:address>/events", views.sync_events, name="sync-events"),
     path(
         "save-address-to-folder",
         views.save_address_to_folder,
@@ -21,11 +31,24 @@ urlpatterns = [
         name="create-or-select-folder",
     ),
     path("folder/<str:folder_id>", views.show_folder, name="show-folder"),
+    path(
+        "folder/<str:folder_id>/export",
+        views.export_folder_transactions,
+        name="export-folder-transactions",
+    ),
     path(
         "<str:address>/transactions", views.show_transactions, name="show-transactions"
     ),
+    path(
+        "<str:address>/transactions/export",
+        views.export_transactions,
+        name="export-transactions",
+    ),
     path("create-folder", views.create_folder, name="create-folder"),
     path("view-folders", views.show_folders, name="show-folders"),
+    path("search-folders", views.search_folders, name="search-folders"),
+    path("search-addresses", views.search_addresses, name="search-addresses"),
+    path("search-transactions", views.search_transactions, name="search-transactions"),
     path("<str:folder_id>/edit", views.edit_folder_name, name="edit-folder-name"),
     path("<str:folder_id>/delete", views.delete_folder, name="delete-folder"),
 ]
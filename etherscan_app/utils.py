@@ -1,47 +1,422 @@
-import os
+import re
+import time
+from datetime import datetime
 
-import ratelimiter
-import requests
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+from django.utils.timezone import utc
 
-from etherscan_app.models import Address, Transaction
+from Crypto.Hash import keccak
+from django_q.tasks import async_task
 
+from etherscan_app import progress
+from etherscan_app.client import EtherscanError, get_client
+from etherscan_app.metrics import (INGEST_BATCH_SECONDS, TASKS_QUEUED,
+                                   TRANSACTIONS_INSERTED, flushes_metrics)
+from etherscan_app.models import (Address, AddressStats, AddressTransaction,
+                                  Transaction)
+from etherscan_app.pagecache import bump_address_page_versions
 
-@ratelimiter.RateLimiter(max_calls=5, period=1)
-def get_address_response(address):
+ADDRESS_PATTERN = re.compile(r"^0x[0-9a-fA-F]{40}$")
+# str.isdigit also accepts digits like "²" that int and the database reject
+NUMBER_PATTERN = re.compile(r"[0-9]+")
+BACKFILLED_FIELDS = [
+    "block_number",
+    "timestamp",
+    "gas",
+    "gas_price",
+    "gas_used",
+    "is_error",
+]
+
+
+def is_number(value):
+    """
+    Takes in a query parameter
+    Returns whether it's a non negative integer written in ASCII digits
+    """
+    return NUMBER_PATTERN.fullmatch(value) is not None
+
+
+def to_checksum_address(address):
+    """
+    Takes in a hex address
+    Returns it with the EIP-55 mixed case checksum
+    """
+    hex_address = address[2:].lower()
+    hash = keccak.new(digest_bits=256, data=hex_address.encode()).hexdigest()
+    return "0x" + "".join(
+        x.upper() if int(hash[i], 16) >= 8 else x for i, x in enumerate(hex_address)
+    )
+
+
+def validate_address(address):
     """
     Takes in an address
+    Checks its format and, for mixed case addresses, its checksum without calling the API
+    Returns:
+    bool (whether or not the address is valid)
+    str (error message)
+    """
+    if not address or not ADDRESS_PATTERN.match(address):
+        return False, "Error! Invalid address format"
+    hex_address = address[2:]
+    is_checksummed = not (hex_address.islower() or hex_address.isupper())
+    if is_checksummed and to_checksum_address(address) != address:
+        return False, "Error! Invalid address checksum"
+    return True, None
+
+
+def queue_address_sync(pk, start_block=None):
+    """
+    Takes in a saved address
+    Queues a background sync of its transactions unless one is already queued or running
+    """
+    if not progress.claim_sync(pk):
+        return False
+    async_task(
+        "etherscan_app.utils.sync_address_transactions",
+        pk,
+        start_block,
+        time_limit=settings.SYNC_TASK_SECONDS,
+    )
+    TASKS_QUEUED.inc(task="sync")
+    return True
+
+
+def get_address_response(
+    address, start_block=0, end_block=99999999, page_size=None, page=1
+):
+    """
+    Takes in an address, the block range and optionally a page size and number
     Returns:
     bool (whether or not the address is valid)
     dict (response json)
     """
-    api_token = os.environ.get("ETHERSCAN_API_TOKEN")
-    if not api_token:
+    response_data = get_client().cached_txlist(
+        address,
+        start_block=start_block,
+        end_block=end_block,
+        page_size=page_size,
+        page=page,
+    )
+    if response_data is None:
         return None, None
-
-    etherscan_api = f"https://api.etherscan.io/api?module=account&action=txlist&address={address}&startblock=0&endblock=99999999&sort=asc&apikey={api_token}"
-    response = requests.get(etherscan_api)
-    response_data = response.json()
     valid_address = response_data["status"] == "1" and response_data["message"] == "OK"
 
     return valid_address, response_data
 
 
+def get_transaction_page(address, page_size, **params):
+    """
+    Takes in an address, a page size and the block range and page number to fetch
+    Returns the transaction data of the page, empty without transactions
+    """
+    valid_address, response_data = get_address_response(
+        address, page_size=page_size, **params
+    )
+    if response_data is None:
+        raise EtherscanError("API token isn't provided")
+
+    result_data = response_data["result"]
+    if not valid_address:
+        # "No transactions found" comes back as an empty list
+        if isinstance(result_data, list):
+            return []
+        raise EtherscanError(result_data)
+    return result_data
+
+
+def iter_address_transactions(address, start_block=0, page_size=None):
+    """
+    Takes in an address and the first block to fetch from
+    Yields the transaction data page by page, every page ending on a complete block
+    """
+    page_size = page_size or settings.ETHERSCAN_PAGE_SIZE
+    while True:
+        result_data = get_transaction_page(address, page_size, start_block=start_block)
+        if len(result_data) < page_size:
+            if result_data:
+                yield result_data
+            return
+
+        # The last block of a full page may continue on the next page
+        last_block = int(result_data[-1]["blockNumber"])
+        complete_data = [x for x in result_data if int(x["blockNumber"]) != last_block]
+        if complete_data:
+            yield complete_data
+            start_block = last_block
+            continue
+
+        # The whole page is one block, whose other pages are fetched on their own and
+        # yielded with it so the synced block never lands in the middle of a block
+        block_data = result_data
+        page = 1
+        while len(result_data) == page_size:
+            page += 1
+            result_data = get_transaction_page(
+                address,
+                page_size,
+                start_block=last_block,
+                end_block=last_block,
+                page=page,
+            )
+            block_data = block_data + result_data
+        yield block_data
+        start_block = last_block + 1
+
+
+@flushes_metrics
+def sync_address_transactions(
+    pk, start_block=None, time_limit=None, created_count=0, page_count=0
+):
+    """
+    Takes in a saved address, optionally a time limit and the counts of the tasks that
+    synced it so far
+    Fetches and stores its transactions page by page, from its synced block by default
+    Past the time limit, the rest is left to a new task starting from the synced block
+    Returns the number of new transactions stored by this call
+    """
+    if start_block is None:
+        start_block = Address.objects.get(pk=pk).start_block
+    started_at = time.monotonic()
+    task_created_count = 0
+    is_finished = True
+    progress.set_sync_status(
+        pk, progress.RUNNING, transactions=created_count, pages=page_count
+    )
+    try:
+        for result_data in iter_address_transactions(pk, start_block=start_block):
+            with INGEST_BATCH_SECONDS.time():
+                batch_count = create_or_update_transaction(pk, result_data)
+            TRANSACTIONS_INSERTED.inc(batch_count)
+            task_created_count += batch_count
+            created_count += batch_count
+            page_count += 1
+            progress.set_sync_status(
+                pk, progress.RUNNING, transactions=created_count, pages=page_count
+            )
+            if time_limit is not None and time.monotonic() - started_at >= time_limit:
+                is_finished = False
+                break
+    except Exception as e:
+        progress.set_sync_status(pk, progress.ERROR, error=str(e))
+        raise
+    if task_created_count:
+        async_task("etherscan_app.indexes.index_address_transactions", pk, start_block)
+        TASKS_QUEUED.inc(task="index-transactions")
+    if not is_finished:
+        # Every page ends on a complete block, so the next task resumes from the
+        # synced block. The running status keeps other syncs of the address out
+        async_task(
+            "etherscan_app.utils.sync_address_transactions",
+            pk,
+            time_limit=time_limit,
+            created_count=created_count,
+            page_count=page_count,
+        )
+        TASKS_QUEUED.inc(task="sync")
+        return task_created_count
+    progress.set_sync_status(
+        pk, progress.DONE, transactions=created_count, pages=page_count
+    )
+    return task_created_count
+
+
+def get_transaction_fields(transaction):
+    """
+    Takes in a transaction of the txlist response
+    Returns the Transaction field values
+    """
+    return {
+        "block_number": int(transaction["blockNumber"]),
+        "timestamp": datetime.fromtimestamp(int(transaction["timeStamp"]), tz=utc),
+        "from_account": transaction["from"],
+        "to_account": transaction["to"],
+        "value_in_wei": int(transaction["value"]),
+        "gas": int(transaction["gas"]),
+        "gas_price": int(transaction["gasPrice"]),
+        "gas_used": int(transaction["gasUsed"]),
+        "is_error": transaction["isError"] == "1",
+    }
+
+
+def get_direction(transaction, address):
+    """
+    Takes in a transaction of the txlist response and the address it was fetched for
+    Returns the role of the address in the transaction
+    """
+    address = address.lower()
+    if transaction["from"].lower() == address:
+        if transaction["to"].lower() == address:
+            return AddressTransaction.SELF
+        return AddressTransaction.OUT
+    return AddressTransaction.IN
+
+
 def create_or_update_transaction(pk, result_data):
     """
     Takes in a valid address
-    Populates transaction data of the address
-    """
-    address_instance = Address.objects.get(pk=pk)
-    transactions = []
-    for transaction in result_data:
-        hash = transaction["hash"]
-        if not address_instance.transactions.filter(hash=hash):
-            transaction_instance = Transaction(
-                address=address_instance,
-                hash=hash,
-                from_account=transaction["from"],
-                to_account=transaction["to"],
-                value_in_ether=float(transaction["value"]) / 1e18,
-            )
-            transactions.append(transaction_instance)
-    Transaction.objects.bulk_create(transactions)
+    Populates transaction data of the address and advances its synced block
+    Transactions already saved for another address are linked instead of copied
+    Transactions saved before their details were stored get them filled in
+    Returns the number of transactions new to the address
+    """
+    with db_transaction.atomic():
+        address_instance = Address.objects.select_for_update().get(pk=pk)
+        synced_block = address_instance.synced_block
+        transactions_by_hash = {}
+        directions = {}
+        for transaction in result_data:
+            fields = get_transaction_fields(transaction)
+            if synced_block is None or fields["block_number"] > synced_block:
+                synced_block = fields["block_number"]
+            transactions_by_hash[transaction["hash"]] = Transaction(
+                hash=transaction["hash"], **fields
+            )
+            directions[transaction["hash"]] = get_direction(transaction, pk)
+
+        existing_transactions = dict(
+            Transaction.objects.filter(hash__in=transactions_by_hash).values_list(
+                "hash", "timestamp"
+            )
+        )
+        # ignore_conflicts covers rows inserted by a concurrent task since the lookup,
+        # e.g. the sync of the counterparty
+        Transaction.objects.bulk_create(
+            [
+                x
+                for hash, x in transactions_by_hash.items()
+                if hash not in existing_transactions
+            ],
+            batch_size=settings.TRANSACTION_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        incomplete_hashes = [
+            hash
+            for hash, timestamp in existing_transactions.items()
+            if timestamp is None
+        ]
+        # Addresses whose pages show the transactions changed by this page, and the
+        # links of the other addresses whose documents hold the old block number
+        changed_addresses = {pk}
+        backfilled_links = []
+        if incomplete_hashes:
+            backfilled_links = list(
+                AddressTransaction.objects.filter(transaction_id__in=incomplete_hashes)
+                .exclude(address_id=pk)
+                .values_list("pk", "address_id")
+            )
+            changed_addresses.update(x for _, x in backfilled_links)
+            Transaction.objects.bulk_update(
+                [transactions_by_hash[hash] for hash in incomplete_hashes],
+                BACKFILLED_FIELDS,
+                batch_size=settings.TRANSACTION_BATCH_SIZE,
+            )
+            # The links of every address carry the block number that was just filled in
+            AddressTransaction.objects.filter(
+                transaction_id__in=incomplete_hashes
+            ).update(
+                block_number=Subquery(
+                    Transaction.objects.filter(hash=OuterRef("transaction_id")).values(
+                        "block_number"
+                    )
+                )
+            )
+
+        # Links are only written under the address lock, so the lookup is current
+        linked_hashes = set(
+            AddressTransaction.objects.filter(
+                address_id=pk, transaction_id__in=transactions_by_hash
+            ).values_list("transaction_id", flat=True)
+        )
+        links = [
+            AddressTransaction(
+                address_id=pk,
+                transaction=transaction,
+                direction=directions[hash],
+                block_number=transaction.block_number,
+            )
+            for hash, transaction in transactions_by_hash.items()
+            if hash not in linked_hashes
+        ]
+        AddressTransaction.objects.bulk_create(
+            links, batch_size=settings.TRANSACTION_BATCH_SIZE
+        )
+
+        if links:
+            update_address_stats(pk, links)
+
+        # update() keeps the post_save signal from fetching the address again
+        Address.objects.filter(pk=pk).update(
+            synced_block=synced_block, updated_at=timezone.now()
+        )
+    if backfilled_links:
+        # Outside the lock of this address, the sync of another one could hold theirs
+        # while waiting for it. updated_at is the Last-Modified of their API pages
+        Address.objects.filter(pk__in=changed_addresses - {pk}).update(
+            updated_at=timezone.now()
+        )
+        async_task(
+            "etherscan_app.indexes.index_links", [x for x, _ in backfilled_links]
+        )
+        TASKS_QUEUED.inc(task="index-transactions")
+    bump_address_page_versions(changed_addresses)
+    return len(links)
+
+
+def update_address_stats(pk, links):
+    """
+    Takes in an address, locked by the caller, and its new transaction links
+    Adds their transactions to the totals of the address
+    """
+    stats, _ = AddressStats.objects.get_or_create(address_id=pk)
+    stats.transaction_count += len(links)
+    for link in links:
+        transaction = link.transaction
+        if link.direction in (AddressTransaction.IN, AddressTransaction.SELF):
+            stats.total_in_wei += transaction.value_in_wei
+        if link.direction in (AddressTransaction.OUT, AddressTransaction.SELF):
+            stats.total_out_wei += transaction.value_in_wei
+        if stats.last_activity is None or transaction.timestamp > stats.last_activity:
+            stats.last_activity = transaction.timestamp
+    stats.save()
+
+
+def rebuild_address_stats(addresses=None):
+    """
+    Takes in addresses, all of them by default
+    Recomputes their totals from the saved transactions
+    Returns the number of rebuilt addresses
+    """
+    address_list = Address.objects.all()
+    if addresses:
+        address_list = address_list.filter(pk__in=addresses)
+    in_directions = [AddressTransaction.IN, AddressTransaction.SELF]
+    out_directions = [AddressTransaction.OUT, AddressTransaction.SELF]
+
+    rebuilt_count = 0
+    for pk in address_list.values_list("pk", flat=True).iterator(chunk_size=1000):
+        # Locked like the ingest so no page is saved between the sums and the write
+        with db_transaction.atomic():
+            Address.objects.select_for_update().get(pk=pk)
+            stats = AddressTransaction.objects.filter(address_id=pk).aggregate(
+                transaction_count=Count("id"),
+                total_in_wei=Sum(
+                    "transaction__value_in_wei",
+                    filter=Q(direction__in=in_directions),
+                ),
+                total_out_wei=Sum(
+                    "transaction__value_in_wei",
+                    filter=Q(direction__in=out_directions),
+                ),
+                last_activity=Max("transaction__timestamp"),
+            )
+            stats["total_in_wei"] = stats["total_in_wei"] or 0
+            stats["total_out_wei"] = stats["total_out_wei"] or 0
+            AddressStats.objects.update_or_create(address_id=pk, defaults=stats)
+        bump_address_page_versions([pk])
+        rebuilt_count += 1
+    return rebuilt_count
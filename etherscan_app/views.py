@@ -1,14 +1,31 @@
+import json
+from functools import wraps
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
-from django.shortcuts import redirect, render
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
+from asgiref.sync import sync_to_async
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
 from etherscan_app.forms import (AddressSearchForm, FolderCreationFrom,
                                  FolderRenameForm, FolderSelectionForm, 
                                  AliasCreationForm)
-from etherscan_app.models import Address, Folder, AddressUserRelationship
-from etherscan_app.utils import get_address_response
+from etherscan_app.exports import EXPORT_FORMATS
+from etherscan_app.metrics import REGISTRY
+from etherscan_app.models import Address, Folder, AddressUserRelationship, AddressTransaction
+from etherscan_app.pagecache import cache_user_page, get_page_version
+from etherscan_app.pagination import paginate_transactions
+from etherscan_app.progress import get_sync_status, iter_sync_statuses
+from etherscan_app.utils import is_number, queue_address_sync, validate_address
+
 
+def metrics(request):
+    return HttpResponse(generate_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST)
 
 @login_required(login_url='/login')
 def index(request):
@@ -19,28 +36,43 @@ def search(request):
     form = AddressSearchForm()
     return render(request, 'etherscan_app/search.html', {'form': form})
 
-@login_required(login_url='/login')
-def submit_address(request):
-    #TODO make it faster to show the results 
-    address = request.POST.get('address')
-    valid_address, response_data = get_address_response(address)
-    if not valid_address and not response_data:
-        # no api token
-        print("Please provide api_token.")
-        return HttpResponse(status=500)
+def async_login_required(login_url):
+    """
+    login_required for async views, which Django 3.2's decorator can't wrap
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # request.user is loaded from the session lazily, with a query
+            is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+            if not is_authenticated:
+                return redirect_to_login(request.get_full_path(), login_url)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
 
-    result_data = response_data['result']
-    user = request.user
+def save_user_address(user, address):
+    """
+    Takes in a user and a valid address
+    Saves the address for the user and queues the sync of its transactions
+    """
+    address_instance, created = Address.objects.get_or_create(address=address)
+    if not created:
+        # new addresses are queued by the post_save signal
+        queue_address_sync(address_instance.pk)
+    AddressUserRelationship.objects.get_or_create(user=user, address=address_instance)
+    return address_instance
+
+@async_login_required(login_url='/login')
+async def submit_address(request):
+    address = request.POST.get('address')
+    valid_address, error = validate_address(address)
+    if not valid_address:
+        return HttpResponse(f"{error}", status=400)
 
-    if valid_address:
-        address_instance, _ = Address.objects.get_or_create(address=address)
-        AddressUserRelationship.objects.get_or_create(user=user, address=address_instance)
-        pk = address_instance.pk
-        return redirect(reverse('etherscan_app:results', kwargs={'address': pk}))
-    elif result_data == 'Error! Invalid address format':
-        return HttpResponse(f"{result_data}", status=400)
-    print(f'status:{response_data["status"]}, message: {response_data["message"]}, result: {result_data}')
-    return HttpResponse(status=400)
+    address_instance = await sync_to_async(save_user_address)(request.user, address)
+    pk = address_instance.pk
+    return redirect(reverse('etherscan_app:results', kwargs={'address': pk}))
 
 @login_required(login_url='/login')
 def show_results(request, address):
@@ -49,9 +81,37 @@ def show_results(request, address):
     context = {
         'address': address.pk, 
         'alias_creation_form': alias_creation_form,
+        'sync_status': get_sync_status(address.pk),
     }
     return render(request, 'etherscan_app/results.html', context=context)
 
+@async_login_required(login_url='/login')
+async def sync_status(request, address):
+    address = await sync_to_async(get_object_or_404)(Address, users=request.user, pk=address)
+    status = await sync_to_async(get_sync_status)(address.pk)
+    return JsonResponse(status or {'state': None})
+
+def iter_sync_events(address):
+    """
+    Takes in an address
+    Yields its sync statuses as server-sent events, and comments to keep the connection open
+    """
+    statuses = iter_sync_statuses(address, settings.SYNC_EVENTS_TIMEOUT, settings.SYNC_EVENTS_KEEPALIVE)
+    for status in statuses:
+        if status is None:
+            yield ': keepalive\n\n'
+        else:
+            yield f'data: {json.dumps(status)}\n\n'
+
+@login_required(login_url='/login')
+def sync_events(request, address):
+    address = get_object_or_404(Address, users=request.user, pk=address)
+    response = StreamingHttpResponse(iter_sync_events(address.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required(login_url='/login')
 def save_address_alias(request):
     print(request.POST.get('alias'))
@@ -90,26 +150,63 @@ def save_address_to_folder(request):
     return redirect(reverse('etherscan_app:show-folder', kwargs={'folder_id':folder_id}))
 
 @login_required(login_url='/login')
+@cache_user_page
 def show_folder(request, folder_id):
     folder = Folder.objects.get(user=request.user, pk=folder_id)
-    addresses = folder.addresses.all()
-
-    address_user_instances = []
-    for address in addresses:
-        address_user_instance = AddressUserRelationship.objects.get(user=request.user, address=address)
-        address_user_instances.append(address_user_instance)
-            
+    address_user_instances = (
+        AddressUserRelationship.objects
+        .filter(user=request.user, address__folders=folder)
+        .select_related('address', 'address__stats')
+        .order_by('address')
+    )
     return render(request, 'etherscan_app/show_folder.html', {'folder': folder, 'address_user_instances': address_user_instances})
 
+def get_user_address(user, address):
+    """
+    Takes in a user and one of their addresses or its alias
+    Returns the address instance
+    """
+    if AddressUserRelationship.objects.filter(user=user, alias=address).exists():
+        return AddressUserRelationship.objects.get(user=user, alias=address).address
+    return Address.objects.get(users=user, pk=address)
+
+def export_response(links, export_format, filename):
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse(f"Unknown export format {export_format}", status=400)
+    iter_rows, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(iter_rows(links), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
 @login_required(login_url='/login')
+@cache_user_page
 def show_transactions(request, address):
-    user = request.user
-    if AddressUserRelationship.objects.filter(user=user, alias=address).exists():
-        address_instance = AddressUserRelationship.objects.get(user=request.user, alias=address).address
-    else: 
-        address_instance = Address.objects.get(users=user, pk=address)
-    transactions = address_instance.transactions.all()
-    return render(request, 'etherscan_app/show_transactions.html', {'address': address, 'transactions': transactions})
+    address_instance = get_user_address(request.user, address)
+    transactions, next_cursor = paginate_transactions(
+        address_instance.transaction_links.all(),
+        request.GET.get('after'),
+        settings.TRANSACTIONS_PAGE_SIZE,
+    )
+    context = {
+        'address': address,
+        'transactions': transactions,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
+    }
+    return render(request, 'etherscan_app/show_transactions.html', context)
+
+@login_required(login_url='/login')
+def export_transactions(request, address):
+    address_instance = get_user_address(request.user, address)
+    export_format = request.GET.get('format', 'csv')
+    return export_response(address_instance.transaction_links.all(), export_format, address_instance.pk)
+
+@login_required(login_url='/login')
+def export_folder_transactions(request, folder_id):
+    folder = get_object_or_404(Folder, user=request.user, pk=folder_id)
+    links = AddressTransaction.objects.filter(address__folders=folder)
+    export_format = request.GET.get('format', 'csv')
+    return export_response(links, export_format, f'folder-{folder.pk}')
 
 @login_required(login_url='/login')
 def create_folder(request):
@@ -129,8 +226,73 @@ def create_folder(request):
 @login_required(login_url='/login')
 def show_folders(request):
     user = request.user
-    folders = user.folders.all()
-    return render(request, 'etherscan_app/show_folders.html', {'folders': folders})
+    folders = user.folders.annotate(
+        address_count=Count('addresses'),
+        transaction_count=Sum('addresses__stats__transaction_count'),
+        total_in_wei=Sum('addresses__stats__total_in_wei'),
+        total_out_wei=Sum('addresses__stats__total_out_wei'),
+        last_activity=Max('addresses__stats__last_activity'),
+    ).order_by('pk')
+    context = {
+        'folders': folders,
+        # the folder list is cached apart from the CSRF token of the form around it
+        'page_version': get_page_version(user.pk),
+        'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+    }
+    return render(request, 'etherscan_app/show_folders.html', context)
+
+def get_search_context(request, search):
+    """
+    Takes in a request and a function returning the results of a query between two offsets
+    Returns the context of the results page picked by the q and page parameters
+    """
+    search_query = request.GET.get('q', '').strip()
+    page = request.GET.get('page', '')
+    page = int(page) if is_number(page) and int(page) > 0 else 1
+    page_size = settings.SEARCH_PAGE_SIZE
+    results = []
+    if search_query:
+        # one extra hit tells whether there's a next page
+        results = list(search(search_query, (page - 1) * page_size, page_size + 1))
+    return {
+        'search_query': search_query,
+        'results': results[:page_size],
+        'page': page,
+        'has_next': len(results) > page_size,
+    }
+
+@login_required(login_url='/login')
+def search_folders(request):
+    def search(search_query, offset, limit):
+        return request.user.folders.search(search_query, user=request.user, offset=offset, limit=limit)
+
+    context = get_search_context(request, search)
+    return render(request, 'etherscan_app/search_folders.html', context)
+
+@login_required(login_url='/login')
+def search_addresses(request):
+    def search(search_query, offset, limit):
+        return (
+            AddressUserRelationship.objects.filter(user=request.user)
+            .search(search_query, user=request.user, offset=offset, limit=limit)
+        )
+
+    context = get_search_context(request, search)
+    return render(request, 'etherscan_app/search_addresses.html', context)
+
+@login_required(login_url='/login')
+def search_transactions(request):
+    addresses = request.user.addresses.values_list('pk', flat=True)
+
+    def search(search_query, offset, limit):
+        return (
+            AddressTransaction.objects.filter(address__in=addresses)
+            .select_related('transaction')
+            .search(search_query, addresses=addresses, offset=offset, limit=limit)
+        )
+
+    context = get_search_context(request, search)
+    return render(request, 'etherscan_app/search_transactions.html', context)
 
 @login_required(login_url='/login')
 def edit_folder_name(request, folder_id):
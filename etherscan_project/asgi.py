@@ -10,7 +10,40 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.urls import Resolver404, resolve
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'etherscan_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+# Django 3.2 iterates streaming responses on the event loop, where the ORM and
+# blocking Redis reads can't run, so the exports and the sync events are served by
+# the WSGI handler from a thread of their own
+streaming_application = WsgiToAsgi(get_wsgi_application())
+STREAMING_VIEWS = {
+    'etherscan_app:export-transactions',
+    'etherscan_app:export-folder-transactions',
+    'etherscan_app:sync-events',
+}
+
+
+def is_streaming(scope):
+    if scope['type'] != 'http':
+        return False
+    try:
+        return resolve(scope['path']).view_name in STREAMING_VIEWS
+    except Resolver404:
+        return False
+
+
+async def application(scope, receive, send):
+    # Gives the sync views of each request their own thread instead of one
+    # thread shared by the whole process, as Django 4.0 does. WsgiToAsgi runs
+    # the WSGI handler thread sensitive too, so streams need the context as well
+    async with ThreadSensitiveContext():
+        if is_streaming(scope):
+            return await streaming_application(scope, receive, send)
+        return await django_application(scope, receive, send)
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'etherscan_app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -100,7 +101,17 @@ CACHES = {
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient"
         }
-    }
+    },
+    # Etherscan API responses, TIMEOUT is how long they are reused
+    "etherscan": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://redis:6379/2",
+        "TIMEOUT": 300,
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "COMPRESSOR": "django_redis.compressors.zlib.ZlibCompressor",
+        }
+    },
 }
 
 # Password validation
@@ -157,7 +168,39 @@ AUTHENTICATION_BACKENDS = (
 SOCIAL_AUTH_LINKEDIN_OAUTH2_KEY= os.environ.get('SOCIAL_AUTH_LINKEDIN_OAUTH2_KEY')
 SOCIAL_AUTH_LINKEDIN_OAUTH2_SECRET=os.environ.get('SOCIAL_AUTH_LINKEDIN_OAUTH2_SECRET')
 SOCIAL_AUTH_LOGIN_REDIRECT_URL = '/login'
+# Several comma separated tokens are used round-robin
 ETHERSCAN_API_TOKEN=os.environ.get('ETHERSCAN_API_TOKEN')
+# Per token, shared by every process through Redis
+ETHERSCAN_RATE_LIMIT = {"max_calls": 5, "period": 1}
+ETHERSCAN_API_URL = "https://api.etherscan.io/api"
+# Connect and read timeouts in seconds
+ETHERSCAN_TIMEOUT = (3.05, 30)
+ETHERSCAN_RETRIES = 3
+ETHERSCAN_BACKOFF = 0.5
+ETHERSCAN_POOL_SIZE = 10
+# Etherscan returns at most 10000 rows for a txlist query
+ETHERSCAN_PAGE_SIZE = 1000
+TRANSACTION_BATCH_SIZE = 1000
+TRANSACTIONS_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 20
+# Seconds the metrics of a process are added up in memory before they're sent to Redis
+METRICS_FLUSH_INTERVAL = 5
+# Largest page of the JSON API, also its default
+API_PAGE_SIZE = 100
+# Rows fetched per round trip by the streaming exports
+EXPORT_CHUNK_SIZE = 2000
+# Cached pages are made stale by version, the timeout only bounds the memory they use
+PAGE_CACHE_TIMEOUT = 60 * 60
+# How long the status of a finished transaction sync is kept in the cache
+SYNC_STATUS_TIMEOUT = 60 * 60 * 24
+# How long a pending or running status outlives its last update, so a sync whose
+# worker was killed (see SYNC_TASK_SECONDS) doesn't block the next one for a day
+SYNC_ACTIVE_STATUS_TIMEOUT = 60 * 5
+# How often a results page hears from the server while nothing happens, and how long
+# one stream follows a sync before the page reconnects. The server can't tell when a
+# page is closed, so a stream holds its thread and Redis connection until the timeout
+SYNC_EVENTS_KEEPALIVE = 15
+SYNC_EVENTS_TIMEOUT = SYNC_EVENTS_KEEPALIVE * 2
 SOCIAL_AUTH_LINKEDIN_OAUTH2_SCOPE = ['r_liteprofile', 'r_emailaddress']
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
@@ -177,8 +220,15 @@ Q_CLUSTER = {
         'port': 6379,
         'db': 0, }
 }
+# A queued transaction sync hands the rest of the address over to a new task once it
+# has run this long, so the worker isn't killed by the Q_CLUSTER timeout mid-sync
+SYNC_TASK_SECONDS = Q_CLUSTER['timeout'] // 2
 
 ELASTICSEARCH_INDEX = 'etherjin'
+# Documents sent per bulk request
+ELASTICSEARCH_BULK_SIZE = 500
+# Seconds changed folders and aliases wait to be indexed together
+SEARCH_INDEX_DEBOUNCE = 5
 ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL')
 if ELASTICSEARCH_URL:
     connections.create_connection(hosts=[ELASTICSEARCH_URL], timeout=30)